@@ -15,13 +15,19 @@ import requests
 import unicodedata
 import logging
 import base64
+import uuid
+import hashlib
 from openai import OpenAI
 import streamlit_extras
 from streamlit_extras.add_vertical_space import add_vertical_space
 from streamlit_extras.row import row
 from pytube import YouTube
-from groq_whisper import split_audio,process_files_concurrently
-from subtitle_translator import wrap_translate
+from groq_whisper import seconds_to_hms,DEFAULT_TRANSCRIPT_OPTIONS
+from pipeline import get_supabase_client,remove_non_ascii,set_notebook_dir,pull_and_run_notebook,save_output,check_dataset_status
+from job_queue import get_job_queue
+from transcript_cache import transcript_cache_key,youtube_video_id
+from worker import spawn_workers
+from workspace import prune_lru
 
 # set logger
 logger = logging.getLogger(__name__)
@@ -47,12 +53,6 @@ def is_image(file_path):
 	except IOError:
 		return False
 
-def get_supabase_client():
-	url = st.secrets['supabase_url']
-	key = st.secrets['supabase_key']
-	supabase = create_client(url, key)
-	return supabase
-
 # insert data to database
 def supabase_insert_message(table,message):
 	supabase = get_supabase_client()
@@ -83,41 +83,6 @@ def supabase_fetch_kofi_by_email(email):
 	data,count = supabase.table('kofi_donation').select("*").eq('email',email).execute()
 	return data
 
-# check if file already exists
-def check_supabase_file_exists(file_path,bucket_name):
-	supabase = get_supabase_client()
-	supabase_storage_ls = supabase.storage.from_(bucket_name).list()
-	
-	if any(file["name"] == os.path.basename(file_path) for file in supabase_storage_ls):
-		return True
-	else:
-		return False
-
-
-# user unicodedata to remove characters that are not ASCII
-def remove_non_ascii(text):
-	return ''.join(c for c in text if ord(c) < 128)
-
-def upload_file_to_supabase_storage(file_path):
-	base_name = remove_non_ascii(os.path.basename(file_path)).replace(' ', '_')
-	path_on_supastorage = os.path.splitext(base_name)[0] + '_' + str(round(time.time())//6000)  + os.path.splitext(base_name)[1]
-	mime_type, _ = mimetypes.guess_type(base_name)
-	
-	supabase = get_supabase_client()
-	bucket_name = st.secrets["bucket_name"]
-
-	try:
-		if check_supabase_file_exists(path_on_supastorage,bucket_name):
-			public_url = supabase.storage.from_(bucket_name).get_public_url(path_on_supastorage)
-		else:
-			supabase.storage.from_(bucket_name).upload(file=file_path, path=path_on_supastorage, file_options={"content-type": mime_type})
-			public_url = supabase.storage.from_(bucket_name).get_public_url(path_on_supastorage)
-	except StorageException as e:
-		print("StorageException:", e)
-		raise
-	return public_url
-
-
 def update_user_msg_pv(email):
 	user_data = supabase_fetch_user_by_email(email)
 	msg_pv = user_data[1][0]["msg_pv"] if user_data[1][0]["msg_pv"] else 0
@@ -154,67 +119,6 @@ def is_donation(email):
 		return False
 
 
-def save_kg_json():
-
-	# save kaggle.json
-	kaggle_json = {
-	"username":st.secrets["kaggle_username"],
-	"key":st.secrets["kaggle_api_key"]
-	}
-
-	kg_json_dir = os.path.expanduser('~/.kaggle')
-
-	mkdir_kaggle_json = subprocess.run(["mkdir","-p",kg_json_dir],check=True)
-
-	# save kaggle json file
-	with open(f'{kg_json_dir}/kaggle.json','w') as f:
-		json.dump(kaggle_json,f)
-
-	chmod = subprocess.run(["chmod","600",os.path.join(kg_json_dir, 'kaggle.json')],check=True)
-
-def set_notebook_dir(kg_notebook_dir):
-	# remove kg_notebook dir if exists
-	rm_kg_notebook = subprocess.run(["rm","-rf",kg_notebook_dir],check=True)
-
-	# create kg_notebook dir 
-	mkdir_kg_notebook = subprocess.run(["mkdir","-p",kg_notebook_dir],check=True)
-
-def pull_and_run_notebook(notebook,kg_notebook_dir):
-	with notebook_pull_spinner_placeholder:
-		with st.spinner("Processing..."):
-			# pull notebook code and metadata
-			pull = subprocess.run(["kaggle","kernels","pull",notebook,"-p",kg_notebook_dir,"-m"],check=True)
-			# check notebook metadata	 
-			with open(os.path.join(kg_notebook_dir,'kernel-metadata.json')) as f:
-				kg_metadata = json.load(f)
-			
-			# push notebook
-			kg_push = subprocess.run(["kaggle", "kernels", "push", "-p", kg_notebook_dir], check=True)
-			return kg_metadata
-
-
-def check_kernel_status_youtube(notebook, interval=5):
-	with notebook_running_spinner_placeholder:
-		# 无限循环，直到状态变为"complete"
-		with st.spinner("Downloading video..."):
-			while True:
-				result = subprocess.run(["kaggle", "kernels", "status", notebook], capture_output=True, text=True)
-				stdout = result.stdout
-				# 提取状态值
-				status = re.findall(r'status "(\w+)"',stdout)[0]
-				st.session_state.youtube_notebook_status = status
-				logger.info(f"The current status is: {status}")
-				# 检查状态是否为"complete"
-				if status == "complete":
-					logger.info("The notebook has finished running.")
-					break
-				elif status == 'error':
-					logger.info("Something wrong, please check the notebook status.")
-					break
-				else:
-					# logger.info("The notebook is still running. Checking again in 5 seconds...")
-					time.sleep(interval)  # 等待5秒
-
 def check_kernel_status_transcript(notebook, interval=5):
 	# 预估总时长
 	estimate_time = 40 + st.session_state.audio_length / 15
@@ -250,28 +154,6 @@ def check_kernel_status_transcript(notebook, interval=5):
 					time.sleep(interval)  # 等待5秒
 
 
-def save_output(notebook,kg_notebook_output_dir):
-	with notebook_save_output_spinner_placeholder:
-		with st.spinner("Processing... "):
-			# remove kg_notebook dir if exists
-			kg_rm_output = subprocess.run(["rm","-rf",kg_notebook_output_dir],check=True)
-			# create output dir
-			kg_mkdir_output = subprocess.run(["mkdir", "-p", kg_notebook_output_dir], check=True)
-			# save output
-			kg_save_output = subprocess.run(["kaggle", "kernels", "output", notebook, "-p", kg_notebook_output_dir], check=True)
-
-def kg_notebook_run_youtube(notebook,kg_notebook_dir,kg_notebook_output_dir):	
-	set_notebook_dir(kg_notebook_dir)
-	
-	pull_and_run_notebook(notebook,kg_notebook_dir)
-	check_kernel_status_youtube(notebook, interval=5)
-	if st.session_state.youtube_notebook_status == "complete":
-		save_output(notebook,kg_notebook_output_dir)
-		st.session_state.youtube_notebook_output = True
-		logger.info('output file saved success!')
-	else:
-		logger.error("opps! something wrong")
-
 def kg_notebook_run_with_transcript(notebook,kg_notebook_dir,kg_notebook_output_dir):	
 	set_notebook_dir(kg_notebook_dir)
 	
@@ -287,17 +169,6 @@ def kg_notebook_run_with_transcript(notebook,kg_notebook_dir,kg_notebook_output_
 
 
 
-def check_dataset_status(dataset):
-	while True:
-		# get dataset creation status
-		dataset_status = subprocess.run(["kaggle","datasets","status",dataset],capture_output=True, text=True)
-		if dataset_status.stdout == 'ready':
-			print("New dataset is ready")
-			break
-		else:
-			print("New dataset is still updating...")
-			time.sleep(5)
-
 def update_transcript_audio(dataset,audio_file,kg_notebook_input_data_dir):
 	with notebook_data_spinner_placeholder:
 		with st.spinner("Preparing your audio/video data for transcription."):
@@ -321,35 +192,6 @@ def update_transcript_audio(dataset,audio_file,kg_notebook_input_data_dir):
 			check_dataset_status(dataset)
 
 
-def update_youtu_url(url,kg_notebook_input_data_dir):
-	# prepare new data
-	youtube_url_file = 'youtube_url.txt'
-	youtube_url_file_path = os.path.join(kg_notebook_input_data_dir,youtube_url_file)
-
-	with open(youtube_url_file_path,'w') as f:
-		f.write(url)
-
-def update_kg_youtube_url(dataset,url,kg_notebook_input_data_dir):
-	with notebook_update_youtube_url_spinner_placeholder:
-		with st.spinner("Processing..."):
-			# remove if exists
-			rm_dataset = subprocess.run(["rm","-rf",kg_notebook_input_data_dir],check=True)
-			
-			# make dataset dir
-			dataset_mkdir = subprocess.run(["mkdir","-p",kg_notebook_input_data_dir],check=True)
-			
-			# download metadata for an existing dataset
-			kg_dataset = subprocess.run(["kaggle","datasets","metadata","-p",kg_notebook_input_data_dir,dataset],check=True)
-
-			# update youtube url
-			update_youtu_url(url,kg_notebook_input_data_dir)
-
-			# create a new dataset version
-			kg_dataset_update = subprocess.run(["kaggle","datasets","version","-p",kg_notebook_input_data_dir,"-m","Updated data"])
-			
-			# check dataset status
-			check_dataset_status(dataset)
-
 def update_kg_transcript_model(transcript_model):
 	dataset = 'zluckyhou/transcript-model'
 	kg_notebook_input_data_dir = 'kg_notebook_input_data_model'
@@ -405,31 +247,6 @@ def youtube_download(video_url, download_path):
 	except Exception as e:
 		logger.error(f"youtube download error: {e}")
 
-from moviepy.editor import VideoFileClip
-
-def get_video_duration(file_path):
-	try:
-		# 加载视频文件
-		clip = VideoFileClip(file_path)
-		
-		# 获取视频时长（以秒为单位）
-		duration = clip.duration
-		
-		# 关闭视频文件
-		clip.close()
-		
-		return duration
-	except Exception as e:
-		print(f"An error occurred: {e}")
-		return None
-
-from pydub import AudioSegment
-
-def get_audio_duration(file_path):
-    audio = AudioSegment.from_file(file_path)
-    duration_seconds = len(audio) / 1000.0
-    return duration_seconds
-
 # import librosa
 # def get_audio_duration(file_path):
 # 	y, sr = librosa.load(file_path)
@@ -439,78 +256,80 @@ def get_audio_duration(file_path):
 
 
 
-def wrap_download_youtube(youtube_url):
-	dataset_url = 'zluckyhou/youtube-url'
-	kg_notebook_input_data_dir_youtu = 'kg_notebook_input_data_url'
-	update_kg_youtube_url(dataset_url,youtube_url,kg_notebook_input_data_dir_youtu)
-	# run youtube_download to get youtube video
-	notebook_name_youtu = "zluckyhou/youtube-download"
-	kg_notebook_dir_youtu = 'kg_notebook_youtu'
-	kg_notebook_output_dir_youtu = 'kg_notebook_output_youtu'
-	kg_notebook_run_youtube(notebook_name_youtu,kg_notebook_dir_youtu,kg_notebook_output_dir_youtu)
-	video_name = [file for file in os.listdir(kg_notebook_output_dir_youtu) if file.endswith('.mp4')][0]
-	youtube_video = os.path.join(kg_notebook_output_dir_youtu,video_name)
-	
-	logger.info(f"youtube video: {youtube_video}")
-	st.session_state.youtube_video = youtube_video
-	audio_length = get_video_duration(youtube_video)
-	st.session_state.audio_length = audio_length
+# 与网页会话独立的 worker 进程，每个服务进程只启动一次；设为 0 时需另行运行 python worker.py
+@st.cache_resource
+def start_job_workers():
+	return spawn_workers(int(st.secrets.get('job_worker_processes',1)))
 
+def get_transcript_options():
+	return {
+		**DEFAULT_TRANSCRIPT_OPTIONS,
+		'backend':st.session_state.backend,
+		'codec':st.secrets.get('chunk_codec','flac'),
+		# 只在开启时加入参数，不影响已有转录结果的缓存键
+		**({'remove_silence':True} if st.session_state.remove_silence else {}),
+		**({'tempo':st.session_state.tempo} if st.session_state.tempo != 1.0 else {}),
+		}
 
 
+# 会话目录和上传目录的大小上限，超过时按最近最少使用删除；
+# 最近 STORAGE_MIN_AGE_SECONDS 内用过的不删，排队或运行中的任务还需要这些文件
+SESSIONS_DIR = 'sessions'
+SESSIONS_MAX_BYTES = 5 * 1024**3
+UPLOAD_DIR_MAX_BYTES = 5 * 1024**3
+STORAGE_MIN_AGE_SECONDS = 6 * 3600
 
+def prune_storage(root,max_bytes_secret,max_bytes):
+	prune_lru(root,int(st.secrets.get(max_bytes_secret,max_bytes)),int(st.secrets.get('storage_min_age_seconds',STORAGE_MIN_AGE_SECONDS)))
+
+# 每个会话独立的目录，保存上传文件和转录结果，避免不同会话之间互相覆盖
+def get_session_dir():
+	session_dir = os.path.join(SESSIONS_DIR,st.session_state.session_id)
+	if not os.path.isdir(session_dir):
+		os.makedirs(session_dir)
+		prune_storage(SESSIONS_DIR,'sessions_max_bytes',SESSIONS_MAX_BYTES)
+	return session_dir
 
-def wrap_transcript_audio(audio_file,target_language):
-	st.session_state.translated_srt = ''
-	st.session_state.translated_srt_url = ''
-	st.session_state.srt_file = ''
-	st.session_state.txt_file = ''
-	st.session_state.srt_file_url = ''
-	st.session_state.txt_file_url = ''
-	with transcripting_placeholder:
-		with st.spinner("Transcribing..."):
-			# remove wav files first
-			logger.info(f"audio file for transcript: {audio_file}")
-			# rm_wav = subprocess.run(["rm","-rf","part*.wav"],check=True)
-			# rm_srt = subprocess.run(["rm","-rf","part*.srt"],check=True)
-			# rm_txt = subprocess.run(["rm","-rf","part*.txt"],check=True)
-			sorted_split_audio_files = split_audio(audio_file)
-			logger.info(f"split files: {sorted_split_audio_files}")
-			logger.info("-----------Transcribing------------")
-			merged_srt, merged_txt = process_files_concurrently(sorted_split_audio_files,audio_file)
-
-			st.session_state.srt_file = merged_srt
-			st.session_state.txt_file = merged_txt
-			logger.info(f"srt file: {merged_srt}")
-			srt_file_url = upload_file_to_supabase_storage(merged_srt)
-			txt_file_url = upload_file_to_supabase_storage(merged_txt)
-			st.session_state.srt_file_url = srt_file_url
-			st.session_state.txt_file_url = txt_file_url
-	if target_language:
-		with translate_placeholder:
-			with st.spinner("Translating..."):
-				translated_srt = wrap_translate(merged_srt,target_language)
-				st.session_state.translated_srt = translated_srt
-				translated_srt_url = upload_file_to_supabase_storage(translated_srt)
-				st.session_state.translated_srt_url = translated_srt_url
 
+# 上传文件按内容哈希保存在共享目录中，按块复制，峰值内存与文件大小无关
+UPLOAD_DIR = 'uploads'
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
 
 def save_uploaded_audio(file_obj):
+	# 上传控件持有文件时每次重新运行都会调用，同一个文件只保存一次
+	if st.session_state.audio_file_id == file_obj.file_id and os.path.exists(st.session_state.audio_file):
+		return
 	base_name = remove_non_ascii(os.path.basename(file_obj.name)).replace(' ', '_')
 	mime_type, _ = mimetypes.guess_type(base_name)
-	# output_path = 'audio_files_' + st.session_state.user_info.get('name','unknown')
-	# remove directory if exists 
-	# rm_user_directory = subprocess.run(["rm","-rf",output_path],check=True)
-	# mkdir_user_directory = subprocess.run(["mkdir","-p",output_path],check=True)
 
-	output_file_path = base_name
-	
-	bytes_data = file_obj.getvalue()
-	with open(output_file_path,'wb') as f:
-		f.write(bytes_data)
+	# 边复制边计算哈希，复制完成后再移动到以哈希命名的目录
+	os.makedirs(UPLOAD_DIR,exist_ok=True)
+	digest = hashlib.sha256()
+	file_obj.seek(0)
+	with NamedTemporaryFile(dir=UPLOAD_DIR,suffix='.part',delete=False) as tmp:
+		try:
+			for block in iter(lambda: file_obj.read(UPLOAD_CHUNK_BYTES),b''):
+				digest.update(block)
+				tmp.write(block)
+		except BaseException:
+			tmp.close()
+			os.remove(tmp.name)
+			raise
+
+	output_file_path = os.path.join(UPLOAD_DIR,digest.hexdigest(),base_name)
+	if os.path.exists(output_file_path):
+		# 相同内容已经保存过，更新修改时间以免被当作最久未用的删除
+		os.remove(tmp.name)
+		os.utime(output_file_path)
+	else:
+		os.makedirs(os.path.dirname(output_file_path),exist_ok=True)
+		os.replace(tmp.name,output_file_path)
+		prune_storage(UPLOAD_DIR,'upload_dir_max_bytes',UPLOAD_DIR_MAX_BYTES)
 
 	st.session_state.audio_file = output_file_path
 	st.session_state.audio_file_type = mime_type
+	st.session_state.audio_file_id = file_obj.file_id
+	st.session_state.audio_file_hash = digest.hexdigest()
 
 # from st_audiorec import st_audiorec
 # def record_and_save_audio():
@@ -536,6 +355,62 @@ def save_uploaded_audio(file_obj):
 
 
 
+def enqueue_transcript_job(kind,source_id,**payload):
+	# 转录在后台 worker 中运行，页面只负责提交任务和轮询状态，刷新页面或断开连接不会中断任务
+	st.session_state.translated_srt = ''
+	st.session_state.translated_srt_url = ''
+	st.session_state.txt_file = ''
+	st.session_state.srt_file_url = ''
+	st.session_state.txt_file_url = ''
+	st.session_state.missing_ranges = []
+	options = get_transcript_options()
+	# 相同来源、转录参数和翻译语言的任务正在进行时，直接等待它的结果
+	dedup_key = transcript_cache_key(source_id,{**options,'target_language':st.session_state.target_language})
+	st.session_state.job_id = get_job_queue().enqueue(kind,{
+		**payload,
+		'source_id':source_id,
+		'options':options,
+		'target_language':st.session_state.target_language,
+		'output_dir':get_session_dir(),
+		},user=st.session_state.user_info['email'],dedup_key=dedup_key)
+	st.session_state.status = 'queued'
+
+
+def apply_job_result(job):
+	# 任务结束后把结果写入会话状态，并记录使用次数和本次消息
+	st.session_state.job_id = ''
+	if job['status'] == 'done':
+		for key,value in job['result'].items():
+			st.session_state[key] = value
+		st.session_state.status = 'success'
+		update_data = update_user_msg_pv(job['user'])
+	else:
+		logger.error(f"Transcript running error: {job['error']}")
+		st.session_state.status = 'error'
+	update_message()
+
+
+@st.fragment(run_every=2)
+def job_status_panel():
+	if not st.session_state.job_id:
+		return
+	job = get_job_queue().get(st.session_state.job_id)
+	if job is None:
+		st.session_state.job_id = ''
+		return
+	if job['status'] == 'queued':
+		st.info("Waiting for a free transcription worker...",icon=":material/hourglass_top:")
+		return
+	if job['status'] == 'running':
+		st.progress(job['progress'],text=job['message'] or "Transcription in progress. Sit tight!")
+		if job['preview']:
+			with st.container(height=300):
+				st.text(job['preview'])
+		return
+	apply_job_result(job)
+	st.rerun()
+
+
 def transcript_youtube(youtube_url):
 	st.session_state.status = ''
 	st.session_state.youtube_video = ''
@@ -549,29 +424,21 @@ def transcript_youtube(youtube_url):
 	logger.info(f"youtube url:{youtube_url}")
 	st.session_state.youtube_url = youtube_url
 	if st.session_state.get('user_info', {}):
-		with transcript_youtube_spinner_placeholder:
-			with st.spinner("Transcription in progress. Sit tight!"):
-				user_name = st.session_state.user_info['name']
-				email = st.session_state.user_info['email']
-				if is_user_valid(email):
-					try:
-						# update_kg_transcript_model(transcript_model)
-						# use youtube-download to download youtube video
-						wrap_download_youtube(youtube_url)
-						# transcript youtube video
-						wrap_transcript_audio(st.session_state.youtube_video,st.session_state.target_language)
-						st.session_state.status = 'success'
-						update_data = update_user_msg_pv(email)
-						# st.session_state.memo = 'success'
-					except Exception as e:
-						logger.error(f"Transcript running error: {e}")
-						st.session_state.status = 'error'
-				else:
-					st.session_state.quota_limit = "Your free usage has been reached. To continue using the service, please support me by clicking the 'Support Me on Ko-fi' button. Your contribution helps fund further development and unlocks additional usage. Even a small donation makes a big difference - it's like buying me a coffee! Thank you for your support."
-					st.session_state.status = 'usage_limit'
-					# st.session_state.memo = 'usage limit'
-					with free_quota_container:
-						st.warning(st.session_state.quota_limit,icon=":material/energy_savings_leaf:")
+		email = st.session_state.user_info['email']
+		if is_user_valid(email):
+			try:
+				video_id = youtube_video_id(youtube_url)
+				enqueue_transcript_job('youtube',f'youtube:{video_id}' if video_id else youtube_url,youtube_url=youtube_url,
+					preview=bool(st.secrets.get('youtube_preview_video',False)))
+			except Exception as e:
+				logger.error(f"Transcript running error: {e}")
+				st.session_state.status = 'error'
+		else:
+			st.session_state.quota_limit = "Your free usage has been reached. To continue using the service, please support me by clicking the 'Support Me on Ko-fi' button. Your contribution helps fund further development and unlocks additional usage. Even a small donation makes a big difference - it's like buying me a coffee! Thank you for your support."
+			st.session_state.status = 'usage_limit'
+			# st.session_state.memo = 'usage limit'
+			with free_quota_container:
+				st.warning(st.session_state.quota_limit,icon=":material/energy_savings_leaf:")
 	else:
 		st.session_state.status = 'not_login'
 		# st.session_state.memo = 'not login'
@@ -589,36 +456,19 @@ def transcript_audio_file(audio_file):
 		return
 	logger.info(f"audio file:{audio_file}")
 	if st.session_state.get('user_info', {}):
-		with transcript_audiofile_spinner_placeholder:
-			with st.spinner("Transcription in progress. Sit tight!"):
-				email = st.session_state.user_info['email']
-				if is_user_valid(email):
-					try:
-						# st.markdown("Transcription task submitted!")
-						mime_type, _ = mimetypes.guess_type(audio_file)
-						logger.debug(f"mime type: {mime_type}")
-						if mime_type.startswith("video"):
-							audio_length = get_video_duration(audio_file)
-						if mime_type.startswith('audio'):
-							audio_length = get_audio_duration(audio_file)
-						st.session_state.audio_length = audio_length
-						logger.debug(f"audio length: {audio_length}")
-
-						# update_kg_transcript_model(transcript_model)
-						# transcript uploaded audio file
-						wrap_transcript_audio(audio_file,st.session_state.target_language)
-						st.session_state.status = 'success'
-						update_data = update_user_msg_pv(email)
-						st.session_state.memo = 'success'
-					except Exception as e:
-						logger.error(f"Transcript running error: {e}")
-						st.session_state.status = 'error'
-				else:
-					st.session_state.quota_limit = "Your free usage has been reached. To continue using the service, please support me by clicking the 'Support Me on Ko-fi' button. Your contribution helps fund further development and unlocks additional usage. Even a small donation makes a big difference - it's like buying me a coffee! Thank you for your support."
-					st.session_state.status = 'usage_limit'
-					# st.session_state.memo = 'usage limit'
-					with free_quota_container:
-						st.warning(st.session_state.quota_limit,icon=":material/energy_savings_leaf:")
+		email = st.session_state.user_info['email']
+		if is_user_valid(email):
+			try:
+				enqueue_transcript_job('file',f'file:{st.session_state.audio_file_hash}',audio_file=audio_file)
+			except Exception as e:
+				logger.error(f"Transcript running error: {e}")
+				st.session_state.status = 'error'
+		else:
+			st.session_state.quota_limit = "Your free usage has been reached. To continue using the service, please support me by clicking the 'Support Me on Ko-fi' button. Your contribution helps fund further development and unlocks additional usage. Even a small donation makes a big difference - it's like buying me a coffee! Thank you for your support."
+			st.session_state.status = 'usage_limit'
+			# st.session_state.memo = 'usage limit'
+			with free_quota_container:
+				st.warning(st.session_state.quota_limit,icon=":material/energy_savings_leaf:")
 	else:
 		st.session_state.status = 'not_login'
 		# st.session_state.memo = 'not login'
@@ -643,6 +493,8 @@ def update_message():
 
 
 
+if "session_id" not in st.session_state:
+	st.session_state.session_id = uuid.uuid4().hex
 if "notebook_status" not in st.session_state:
 	st.session_state.notebook_status = 'preparing' 
 if "notebook_output" not in st.session_state:
@@ -684,9 +536,24 @@ if "audio_file" not in st.session_state:
 	st.session_state.audio_file = ''
 if "audio_file_type" not in st.session_state:
 	st.session_state.audio_file_type = ''
+if "audio_file_id" not in st.session_state:
+	st.session_state.audio_file_id = ''
+if "audio_file_hash" not in st.session_state:
+	st.session_state.audio_file_hash = ''
 if "record_audio_data" not in st.session_state:
 	st.session_state.record_audio_data = ''
 
+if 'job_id' not in st.session_state:
+	st.session_state.job_id = ''
+if 'backend' not in st.session_state:
+	st.session_state.backend = 'groq'
+if 'remove_silence' not in st.session_state:
+	st.session_state.remove_silence = bool(st.secrets.get('remove_silence',False))
+if 'tempo' not in st.session_state:
+	st.session_state.tempo = 1.0
+if 'missing_ranges' not in st.session_state:
+	st.session_state.missing_ranges = []
+
 if 'target_language' not in st.session_state:
 	st.session_state.target_language = ''
 if 'translated_srt' not in st.session_state:
@@ -751,6 +618,18 @@ with st.sidebar:
 	# 	width=200
 	# 	)
 
+	st.divider()
+	transcription_engines = {"Groq (cloud)":"groq","Auto (fastest available)":"auto","Local (CPU)":"local"}
+	engine = st.selectbox("Transcription engine",list(transcription_engines))
+	st.session_state.backend = transcription_engines[engine]
+	st.caption("Groq is the fastest. Local runs faster-whisper on this server and keeps working when Groq is rate-limited. Auto sends each part to whichever is expected to finish first.")
+	st.checkbox("Skip silence",key='remove_silence')
+	st.caption("Long pauses are not sent for transcription, which is faster for lectures and podcasts. Subtitles still match the original timing.")
+	transcription_speeds = {"Normal":1.0,"Fast (1.25×)":1.25,"Faster (1.5×)":1.5}
+	speed = st.selectbox("Speed",list(transcription_speeds))
+	st.session_state.tempo = transcription_speeds[speed]
+	st.caption("Fast modes speed the audio up before transcription for quicker rough drafts, at some cost in accuracy.")
+
 	st.divider()
 	with st.expander("Explore More Apps",icon=":material/apps:"):
 		st.link_button(":owl: ChatGPT-4o", "https://chatgpt-4o.streamlit.app/")
@@ -765,7 +644,14 @@ with st.sidebar:
 
 
 
-save_kg_json()
+start_job_workers()
+
+# 页面刷新或重新打开后，继续显示该用户仍在进行中的任务
+if not st.session_state.job_id and st.session_state.user_info:
+	active_job = get_job_queue().active_for_user(st.session_state.user_info['email'])
+	if active_job:
+		st.session_state.job_id = active_job['id']
+		st.session_state.status = 'queued'
 
 
 st.title("Whisper Flow")
@@ -818,7 +704,7 @@ if img == 'youtube_logo.png':
 		on_click=transcript_youtube,
 		args=[youtube_url],
 		)
-	if transcript_youtube_button and st.session_state.status:
+	if transcript_youtube_button and st.session_state.status not in ('','queued'):
 		logger.debug("update message")
 		update_message()
 
@@ -857,7 +743,7 @@ elif img == 'upload_logo.png':
 		args=[st.session_state.audio_file],
 		# disabled = not st.session_state.audio_file
 		)
-	if transcript_audio_button and st.session_state.status:
+	if transcript_audio_button and st.session_state.status not in ('','queued'):
 		logger.debug("update message")
 		update_message()
 
@@ -901,17 +787,12 @@ if st.session_state.trans_type == 'youtube_url' and st.session_state.youtube_vid
 empty_file_container = st.container()
 empty_url_container = st.container()
 free_quota_container = st.container()
-transcript_youtube_spinner_placeholder = st.empty()
-transcript_audiofile_spinner_placeholder = st.empty()
 
 notebook_model_initialize_placeholder = st.empty()
-notebook_update_youtube_url_spinner_placeholder = st.empty()
 notebook_data_spinner_placeholder = st.empty()
-notebook_pull_spinner_placeholder = st.empty()
 notebook_running_spinner_placeholder = st.empty()
-transcripting_placeholder = st.empty()
-translate_placeholder = st.empty()
-notebook_save_output_spinner_placeholder = st.empty()
+
+job_status_panel()
 
 
 if st.session_state.status == 'success':
@@ -921,8 +802,15 @@ if st.session_state.status == 'success':
 	if st.session_state.trans_type == 'youtube_url' and st.session_state.youtube_video:
 		with youtube_video_placeholder:
 			st.video(st.session_state.youtube_video,subtitles=subtitle)
+	elif st.session_state.trans_type == 'youtube_url' and st.session_state.youtube_url:
+		# 只下载了音频或命中缓存时没有本地视频，直接嵌入 YouTube 播放器
+		with youtube_video_placeholder:
+			st.video(st.session_state.youtube_url)
 	# st.markdown(f"Transcription completed! Download [Audio subtitle]({st.session_state.srt_file_url}) or [Transcription in plain text]({st.session_state.txt_file_url})")
 	st.markdown("Transcription completed! If you need to organize or summarize the text, try [ChatGPT-4o](https://chatgpt-4o.streamlit.app/)")
+	if st.session_state.missing_ranges:
+		missing = ', '.join(f"{seconds_to_hms(start)} - {seconds_to_hms(end)}" for start,end in st.session_state.missing_ranges)
+		st.warning(f"Some parts could not be transcribed after several retries: {missing}",icon="⚠️")
 	# col1,col2 = st.columns(2)
 
 	with open(subtitle) as file:
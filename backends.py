@@ -0,0 +1,124 @@
+import time
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionBackend:
+	"""A transcription engine that turns one chunk into chunk-relative segments.
+
+	Subclasses implement `transcribe`, a coroutine run on the shared event loop
+	that returns a list of {'start', 'end', 'text'} dicts with times relative to
+	the start of the chunk, and `model_name`, used in cache keys. `capacity`,
+	`seconds_per_audio_second` and `estimated_wait()` describe the backend to
+	BackendRouter.
+	"""
+
+	name = ''
+	# 可同时处理的分片数，以及每秒音频的预估处理耗时（路由器在积累实际数据前使用）
+	capacity = 1
+	seconds_per_audio_second = 1.0
+
+	def model_name(self,options):
+		return options['model']
+
+	def estimated_wait(self,audio_seconds):
+		# 因限流等原因，新请求需要等待多久才能开始
+		return 0.0
+
+	async def transcribe(self,chunk,options):
+		raise NotImplementedError
+
+
+class BackendStats:
+	"""Exponentially weighted latency (seconds per audio second) and error rate of one backend."""
+
+	def __init__(self,seconds_per_audio_second,alpha=0.2):
+		self.alpha = alpha
+		self.latency = seconds_per_audio_second
+		self.error_rate = 0.0
+		self.in_flight = 0
+
+	def record(self,elapsed,audio_seconds,error):
+		self.error_rate += self.alpha * ((1.0 if error else 0.0) - self.error_rate)
+		if not error and audio_seconds > 0:
+			self.latency += self.alpha * (elapsed / audio_seconds - self.latency)
+
+
+class BackendRouter(TranscriptionBackend):
+	"""Send each chunk to the backend with the lowest expected completion time, failing over chunk by chunk.
+
+	The estimate combines the backend's rate-limit wait, its EWMA latency scaled
+	by the chunk length and current queueing, and its EWMA error rate. If the
+	chosen backend fails, the chunk is retried on the next best one.
+	"""
+
+	name = 'auto'
+
+	def __init__(self,backend_names):
+		self.backend_names = backend_names
+		self.stats = {}
+
+	def model_name(self,options):
+		return '+'.join(f'{name}:{get_backend(name).model_name(options)}' for name in self.backend_names)
+
+	def _stats(self,backend):
+		if backend.name not in self.stats:
+			self.stats[backend.name] = BackendStats(backend.seconds_per_audio_second)
+		return self.stats[backend.name]
+
+	def expected_completion(self,backend,audio_seconds):
+		stats = self._stats(backend)
+		service = stats.latency * audio_seconds
+		queueing = service * stats.in_flight / backend.capacity
+		# 失败率越高，预期需要的重试越多
+		return (backend.estimated_wait(audio_seconds) + service + queueing) / max(1.0 - stats.error_rate,0.05)
+
+	async def transcribe(self,chunk,options):
+		audio_seconds = chunk['end'] - chunk['start']
+		backends = sorted((get_backend(name) for name in self.backend_names),key=lambda b: self.expected_completion(b,audio_seconds))
+		last_exc = None
+		for backend in backends:
+			stats = self._stats(backend)
+			stats.in_flight += 1
+			started = time.monotonic()
+			try:
+				segments = await backend.transcribe(chunk,options)
+			except Exception as exc:
+				stats.record(time.monotonic() - started,audio_seconds,error=True)
+				logger.warning(f"{backend.name} failed on chunk {chunk['index']} ({exc}), failing over")
+				last_exc = exc
+				continue
+			finally:
+				stats.in_flight -= 1
+			stats.record(time.monotonic() - started,audio_seconds,error=False)
+			return segments
+		raise last_exc
+
+
+# 进程内共享的后端实例，按名称懒加载，避免未使用的后端引入额外依赖
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name):
+	with _backends_lock:
+		if name not in _backends:
+			if name == 'groq':
+				from groq_whisper import GroqBackend
+				_backends[name] = GroqBackend()
+			elif name == 'auto':
+				import streamlit as st
+				_backends[name] = BackendRouter(st.secrets.get('router_backends','groq,local').split(','))
+			elif name == 'local':
+				import streamlit as st
+				from local_whisper import LocalWhisperBackend, LOCAL_WHISPER_MODEL
+				_backends[name] = LocalWhisperBackend(
+					model_size=st.secrets.get('local_whisper_model',LOCAL_WHISPER_MODEL),
+					processes=int(st.secrets.get('local_whisper_processes',0)) or None,
+				)
+			else:
+				raise ValueError(f"unknown transcription backend: {name}")
+			logger.info(f"transcription backend ready: {name}")
+		return _backends[name]
@@ -1,12 +1,26 @@
+import io
 import os
 import subprocess
-from groq import Groq
+from groq import AsyncGroq, APIStatusError, APIConnectionError, RateLimitError
+import httpx
+import asyncio
 import json
-import re
-import concurrent.futures
-import time
+import math
+import bisect
+import functools
+import hashlib
+import threading
+import queue
+import random
 import streamlit as st
 import logging
+import wave
+import numpy as np
+from rate_limiter import ApiKeyPool, ApiKeysUnauthorizedError, RateLimitStore, parse_reset_duration
+from job_queue import JOB_DB_PATH
+from transcript_cache import TranscriptCache, transcript_cache_key, TRANSCRIPT_CACHE_DIR
+from backends import TranscriptionBackend, get_backend
+from scheduler import get_loop, get_scheduler
 
 
 
@@ -26,55 +40,360 @@ logger.addHandler(console_handler)
 
 
 
-# 自定义排序键函数，提取文件名中的编号
-def get_file_number(filename):
-	match = re.search(r'part_(\d+).wav', filename)
-	return int(match.group(1)) if match else float('inf')
-
-def split_audio(audio_file):
-	# 第一步：将音频文件降采样并转换为单声道
-	reduced_audio_file = 'reduced_audio.wav'
-	# rm_reduced_audio = subprocess.run(["rm","-rf",reduced_audio_file],check=True)
-	
-	reduce_command = [
+SAMPLE_RATE = 16000
+# 分片时长上限（秒），在目标点之前 CHUNK_SEARCH_SECONDS 的范围内寻找静音点切分
+CHUNK_MAX_SECONDS = 1200
+CHUNK_SEARCH_SECONDS = 30
+# Groq 单个文件的上传大小限制，规划分片时留出一定余量
+GROQ_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+UPLOAD_SIZE_MARGIN = 0.9
+
+# 分片编码方式：flac 无损，opus 低码率用于提速；bytes_per_second 为规划分片时长用的保守估计
+CHUNK_CODECS = {
+	'wav': {'ext': 'wav', 'format': 'wav', 'args': ['-c:a', 'pcm_s16le'], 'bytes_per_second': 32000},
+	'flac': {'ext': 'flac', 'format': 'flac', 'args': ['-c:a', 'flac', '-compression_level', '5'], 'bytes_per_second': 24000},
+	'opus': {'ext': 'ogg', 'format': 'ogg', 'args': ['-c:a', 'libopus', '-b:a', '24k', '-application', 'voip'], 'bytes_per_second': 3200},
+}
+DEFAULT_CHUNK_CODEC = 'flac'
+
+# 转录模型及参数，同时也是转录缓存键的一部分
+DEFAULT_TRANSCRIPT_OPTIONS = {
+	'backend': 'groq',
+	'model': 'whisper-large-v3',
+	'temperature': 0.0,
+	'language': None,
+}
+# 计算能量的帧长，以及寻找停顿时的平滑窗口
+RMS_FRAME_SECONDS = 0.02
+RMS_SMOOTH_SECONDS = 0.4
+# 去除静音：低于阈值且长于 SILENCE_MIN_SECONDS 的片段被删去，两侧各保留 SILENCE_PAD_SECONDS
+SILENCE_THRESHOLD_DBFS = -45
+SILENCE_MIN_SECONDS = 1.0
+SILENCE_PAD_SECONDS = 0.25
+# 快速模式的变速倍数范围（ffmpeg atempo 单级滤镜支持的范围）
+TEMPO_RANGE = (0.5,2.0)
+
+
+def frame_rms(samples,frame_size):
+	# 按帧计算RMS能量，最后不足一帧的部分忽略
+	n_frames = len(samples) // frame_size
+	frames = samples[:n_frames*frame_size].reshape(n_frames,frame_size).astype(np.float32)
+	return np.sqrt(np.mean(frames**2,axis=1))
+
+def quietest_point(samples,lo,hi,sample_rate=SAMPLE_RATE):
+	# 返回 samples[lo:hi] 中平滑能量最低处的采样点位置，避免切在两个音节之间的短暂停顿上
+	frame_size = int(sample_rate * RMS_FRAME_SECONDS)
+	smooth_frames = max(1, int(RMS_SMOOTH_SECONDS / RMS_FRAME_SECONDS))
+	energy = frame_rms(samples[lo:hi],frame_size)
+	if len(energy) < smooth_frames:
+		return hi
+	energy = np.convolve(energy,np.ones(smooth_frames)/smooth_frames,mode='valid')
+	return lo + (int(np.argmin(energy)) + smooth_frames // 2) * frame_size
+
+class SilenceTrimmer:
+	"""Drop long silent spans from 16 kHz mono s16le PCM while it is decoded, keeping a map back to the original time.
+
+	The audio is scanned in RMS_FRAME_SECONDS frames; a run of frames quieter
+	than `threshold_dbfs` that lasts longer than `min_seconds` is cut down to
+	`pad_seconds` of silence on either side. `pieces` holds (kept_sample,
+	original_sample) at the start of each stretch of kept audio.
+	"""
+
+	def __init__(self,threshold_dbfs=SILENCE_THRESHOLD_DBFS,min_seconds=SILENCE_MIN_SECONDS,pad_seconds=SILENCE_PAD_SECONDS,sample_rate=SAMPLE_RATE):
+		self.sample_rate = sample_rate
+		self.frame_size = int(sample_rate * RMS_FRAME_SECONDS)
+		self.threshold = 32768 * 10 ** (threshold_dbfs / 20)
+		self.min_bytes = round(min_seconds / RMS_FRAME_SECONDS) * self.frame_size * 2
+		self.pad_bytes = round(pad_seconds / RMS_FRAME_SECONDS) * self.frame_size * 2
+		self.pending = b''  # 不足一帧的剩余字节
+		# 当前静音段：开头最多 min_bytes 字节、末尾 pad_bytes 字节，以及总字节数
+		self.silence_head = b''
+		self.silence_tail = b''
+		self.silence_bytes = 0
+		self.kept = 0  # 已输出的采样点数
+		self.original = 0  # 已扫描的采样点数
+		self.pieces = [(0,0)]
+
+	def end_silence(self,trailing=False):
+		# 静音段结束：较短时原样保留，较长时只保留两侧各 pad 的部分
+		if self.silence_bytes <= self.min_bytes:
+			out = self.silence_head
+		else:
+			out = self.silence_head[:self.pad_bytes]
+			if not trailing:
+				self.pieces.append((self.kept + len(out) // 2,self.original - len(self.silence_tail) // 2))
+				out += self.silence_tail
+		self.kept += len(out) // 2
+		self.silence_head = self.silence_tail = b''
+		self.silence_bytes = 0
+		return out
+
+	def feed(self,data):
+		"""Scan decoded PCM bytes and return the bytes to keep."""
+		data = self.pending + data
+		n_frames = len(data) // (self.frame_size * 2)
+		self.pending = data[n_frames * self.frame_size * 2:]
+		if not n_frames:
+			return b''
+		quiet = frame_rms(np.frombuffer(data,dtype=np.int16,count=n_frames * self.frame_size),self.frame_size) < self.threshold
+		# 按连续的静音帧和非静音帧分段处理
+		bounds = [0,*(np.flatnonzero(np.diff(quiet)) + 1),n_frames]
+		out = []
+		for lo,hi in zip(bounds[:-1],bounds[1:]):
+			run = data[lo * self.frame_size * 2:hi * self.frame_size * 2]
+			if quiet[lo]:
+				self.silence_head += run[:max(self.min_bytes - len(self.silence_head),0)]
+				self.silence_tail = (self.silence_tail + run)[-self.pad_bytes:] if self.pad_bytes else b''
+				self.silence_bytes += len(run)
+			else:
+				if self.silence_bytes:
+					out.append(self.end_silence())
+				out.append(run)
+				self.kept += len(run) // 2
+			self.original += len(run) // 2
+		return b''.join(out)
+
+	def finish(self):
+		# 末尾的长静音直接截掉，不足一帧的剩余部分原样保留
+		out = self.end_silence(trailing=True) + self.pending
+		self.kept += len(self.pending) // 2
+		self.original += len(self.pending) // 2
+		self.pending = b''
+		logger.info(f"removed {(self.original - self.kept) / self.sample_rate:.1f}s of silence")
+		return out
+
+	def original_sample(self,kept_sample):
+		# 去除静音后音频中的位置 -> 原音频中的位置
+		kept_start,original_start = self.pieces[bisect.bisect_right(self.pieces,(kept_sample,math.inf)) - 1]
+		return original_start + kept_sample - kept_start
+
+	def time_map(self,offset,count):
+		# 分片内的时间映射，[[分片内秒数, 原音频秒数], ...]，供 to_absolute 还原时间
+		time_map = [[0.0,self.original_sample(offset) / self.sample_rate]]
+		for kept_start,original_start in self.pieces:
+			if offset < kept_start < offset + count:
+				time_map.append([(kept_start - offset) / self.sample_rate,original_start / self.sample_rate])
+		return time_map
+
+def chunk_target_seconds(codec=DEFAULT_CHUNK_CODEC,max_upload_bytes=GROQ_MAX_UPLOAD_BYTES):
+	# 按编码后的预估大小确定分片时长，保证每个分片都在上传限制以内
+	size_limited = max_upload_bytes * UPLOAD_SIZE_MARGIN / CHUNK_CODECS[codec]['bytes_per_second']
+	return min(CHUNK_MAX_SECONDS, size_limited)
+
+def write_wav(samples,output_file,sample_rate=SAMPLE_RATE):
+	# output_file 可以是路径，也可以是内存中的文件对象
+	with wave.open(output_file,'wb') as f:
+		f.setnchannels(1)
+		f.setsampwidth(2)
+		f.setframerate(sample_rate)
+		f.writeframes(memoryview(np.ascontiguousarray(samples)).cast('B'))
+
+def encode_chunk(samples,codec=DEFAULT_CHUNK_CODEC,sample_rate=SAMPLE_RATE):
+	"""Encode int16 samples, typically a view of the memory-mapped PCM file, into an in-memory buffer."""
+	buffer = io.BytesIO()
+	if codec == 'wav':
+		write_wav(samples,buffer,sample_rate)
+	else:
+		encode_command = [
+			'ffmpeg',
+			'-loglevel', 'error',
+			'-f', 's16le',
+			'-ar', str(sample_rate),
+			'-ac', '1',
+			'-i', 'pipe:0',
+			*CHUNK_CODECS[codec]['args'],
+			'-f', CHUNK_CODECS[codec]['format'],
+			'pipe:1'
+		]
+		# 采样直接从内存映射写入 ffmpeg，编码结果留在内存中，不落盘
+		result = subprocess.run(encode_command, input=memoryview(np.ascontiguousarray(samples)).cast('B'), check=True, capture_output=True)
+		buffer.write(result.stdout)
+	buffer.seek(0)
+	return buffer
+
+def encode_for_upload(samples,codec=DEFAULT_CHUNK_CODEC,max_upload_bytes=GROQ_MAX_UPLOAD_BYTES):
+	"""Encode samples for upload, returns [(sample_offset, buffer)].
+
+	Usually a single buffer; if the encoding is still over the upload limit,
+	the samples are halved at a quiet point near the middle and each half is
+	encoded on its own.
+	"""
+	buffer = encode_chunk(samples,codec)
+	size = buffer.getbuffer().nbytes
+	if size <= max_upload_bytes or len(samples) <= SAMPLE_RATE:
+		return [(0,buffer)]
+	logger.warning(f"{len(samples) / SAMPLE_RATE:.1f}s of audio encodes to {size} bytes, over the upload limit, splitting it again")
+	mid = len(samples) // 2
+	search = min(int(CHUNK_SEARCH_SECONDS * SAMPLE_RATE),mid // 2)
+	cut = quietest_point(samples,mid - search,mid + search)
+	parts = encode_for_upload(samples[:cut],codec,max_upload_bytes)
+	parts += [(cut + offset,part) for offset,part in encode_for_upload(samples[cut:],codec,max_upload_bytes)]
+	return parts
+
+def pcm_samples(pcm_file,offset=0,count=None):
+	# 内存映射 PCM 文件中从第 offset 个采样点开始的 count 个采样点，切片不复制数据
+	return np.memmap(pcm_file,dtype=np.int16,mode='r',offset=offset*2,shape=None if count is None else (count,))
+
+def chunk_samples(chunk):
+	return pcm_samples(chunk['pcm'],chunk['offset'],chunk['samples'])
+
+def chunk_name(chunk):
+	return f"part_{chunk['index']}.{CHUNK_CODECS[chunk['codec']]['ext']}"
+
+def make_chunk(pcm_file,offset,samples,index,codec=DEFAULT_CHUNK_CODEC,trimmer=None,tempo=1.0):
+	# 分片只记录其在 PCM 文件中的位置，上传前才从内存映射中编码；
+	# start/end 始终为原音频中的时间，去除过静音时 time_map 用于还原分片内的时间，变速时 tempo 为倍数
+	chunk = {
+		'index': index,
+		'pcm': pcm_file,
+		'offset': offset,
+		'samples': len(samples),
+		'codec': codec,
+		'sha256': hashlib.sha256(samples).hexdigest(),
+		'start': offset / SAMPLE_RATE * tempo,
+		'end': (offset + len(samples)) / SAMPLE_RATE * tempo,
+	}
+	if trimmer:
+		chunk['start'] = trimmer.original_sample(offset) / SAMPLE_RATE * tempo
+		chunk['end'] = (trimmer.original_sample(offset + len(samples) - 1) + 1) / SAMPLE_RATE * tempo
+		chunk['time_map'] = [[rel,original * tempo] for rel,original in trimmer.time_map(offset,len(samples))]
+	if tempo != 1.0:
+		chunk['tempo'] = tempo
+	return chunk
+
+# 每次从 ffmpeg 管道读取约 10 秒的 PCM 数据
+PCM_READ_BYTES = SAMPLE_RATE * 2 * 10
+
+def feed_stdin(process,source,errors):
+	# 在后台线程中把 source 产生的字节按顺序写入 ffmpeg 的标准输入
+	try:
+		for data in source:
+			process.stdin.write(data)
+	except BrokenPipeError:
+		# ffmpeg 已退出，原因由其返回码和日志报告
+		pass
+	except Exception as exc:
+		errors.append(exc)
+		process.kill()
+	finally:
+		try:
+			process.stdin.close()
+		except OSError:
+			pass
+
+def iter_chunks(audio_file,workspace,codec=DEFAULT_CHUNK_CODEC,max_upload_bytes=GROQ_MAX_UPLOAD_BYTES,duration=None,remove_silence=False,tempo=1.0):
+	"""Decode audio_file (a path, or an iterable of its bytes) to PCM, yielding chunks as they are decoded.
+
+	Chunks are sample ranges of `audio.pcm` in the workspace; their start/end are in the original media's time.
+	"""
+	if not TEMPO_RANGE[0] <= tempo <= TEMPO_RANGE[1]:
+		raise ValueError(f"tempo {tempo} is outside {TEMPO_RANGE}")
+	target = int(chunk_target_seconds(codec,max_upload_bytes) * SAMPLE_RATE)
+	search = int(CHUNK_SEARCH_SECONDS * SAMPLE_RATE)
+	if duration:
+		# 已知时长时均分为最少数量的分片，避免最后剩下一个很短的分片
+		# 变速后需要切分的音频时长
+		duration = duration / tempo
+		# 切点在 [target - search, target] 内寻找，因此在均分长度上加上搜索窗口，保证不会多出一个短分片
+		n_chunks = math.ceil(duration * SAMPLE_RATE / target)
+		target = min(target,int(duration * SAMPLE_RATE / n_chunks) + search)
+		workspace.ensure_capacity(int(duration * SAMPLE_RATE * 2))
+	# 传入的是字节流（例如正在下载的文件）时通过 stdin 送给 ffmpeg，解码和转录与下载同时进行
+	streaming = not isinstance(audio_file,str)
+
+	decode_command = [
 		'ffmpeg',
-		'-y',
-		'-i', audio_file,
-		'-ar', '16000',
+		*([] if streaming else ['-nostdin']),
+		'-loglevel', 'error',
+		'-i', 'pipe:0' if streaming else audio_file,
+		'-map', '0:a:0',
 		'-ac', '1',
-		'-map', '0:a',
-		reduced_audio_file
+		'-ar', str(SAMPLE_RATE),
+		# 快速模式：降采样的同时用 atempo 加速，上传的音频时长减少为 1/tempo
+		*(['-af', f'atempo={tempo}'] if tempo != 1.0 else []),
+		'-f', 's16le',
+		'pipe:1'
 	]
-
-	# 运行降采样命令
-	subprocess.run(reduce_command, check=True)
-
-	# 第二步：将降采样后的音频文件拆分为多个部分
-	rm_split_files = subprocess.run(["rm","-rf",'split_files'],check=True)
-	# mkdir split files
-	mkdir_split_files = subprocess.run(["mkdir","-p",'split_files'],check=True)
-
-	segment_command = [
+	decode_log = workspace.path('ffmpeg_decode.log')
+	with open(decode_log,'wb') as log_file:
+		process = subprocess.Popen(decode_command, stdin=subprocess.PIPE if streaming else subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=log_file)
+	feed_errors = []
+	if streaming:
+		feeder = threading.Thread(target=feed_stdin,args=(process,audio_file,feed_errors),daemon=True)
+		feeder.start()
+
+	# 解码结果追加写入 audio.pcm，分片只记录采样范围，上传前才在内存中编码（见 encode_for_upload）
+	pcm_file = workspace.path('audio.pcm')
+	# 去除静音：较长的静音段在写入 PCM 文件之前丢弃
+	trimmer = SilenceTrimmer() if remove_silence else None
+	decoded_bytes = 0
+	offset = 0  # 已切出的采样点数
+	index = 0
+	eof = False
+	try:
+		with open(pcm_file,'wb') as pcm:
+			while not eof:
+				data = process.stdout.read(PCM_READ_BYTES)
+				if not data:
+					eof = True
+				if trimmer:
+					data = trimmer.finish() if eof else trimmer.feed(data)
+				pcm.write(data)
+				decoded_bytes += len(data)
+				pcm.flush()
+				n_samples = decoded_bytes // 2 - offset
+				# 解码出超过一个分片的数据就在目标长度附近最安静的位置切出一个分片，文件其余部分继续解码
+				while n_samples > target or (eof and n_samples):
+					samples = pcm_samples(pcm_file,offset,n_samples)
+					if n_samples > target:
+						cut = quietest_point(samples,max(target - search,1),target)
+					else:
+						cut = n_samples
+					chunk = make_chunk(pcm_file,offset,samples[:cut],index,codec,trimmer,tempo)
+					del samples
+					logger.info(f"chunk ready: {chunk_name(chunk)} [{chunk['start']:.1f}s - {chunk['end']:.1f}s]")
+					workspace.ensure_capacity()
+					index += 1
+					offset += cut
+					n_samples = decoded_bytes // 2 - offset
+					yield chunk
+	finally:
+		if not eof and process.poll() is None:
+			process.kill()
+		process.stdout.close()
+		returncode = process.wait()
+
+	if streaming and eof:
+		feeder.join()
+	# 下载等输入端的错误优先于 ffmpeg 的返回码报告
+	if feed_errors:
+		raise feed_errors[0]
+	if returncode != 0:
+		with open(decode_log,errors='replace') as f:
+			raise subprocess.CalledProcessError(returncode,decode_command,stderr=f.read())
+
+def audio_fingerprint(audio_file):
+	# 对解码后的 16kHz 单声道 PCM 求哈希，与容器格式、码率和元数据无关
+	fingerprint_command = [
 		'ffmpeg',
-		'-y',
-		'-i', reduced_audio_file,
-		'-f', 'segment',
-		'-segment_time', '300',
-		'-c', 'copy',
-		'split_files/part_%d.wav'
+		'-nostdin',
+		'-loglevel', 'error',
+		'-i', audio_file,
+		'-map', '0:a:0',
+		'-ac', '1',
+		'-ar', str(SAMPLE_RATE),
+		'-f', 's16le',
+		'pipe:1'
 	]
-
-	# 运行拆分命令
-	subprocess.run(segment_command, check=True)
-
-
-	# 第三步：列出所有拆分后的文件
-	split_audio_files = [os.path.join('split_files',f) for f in os.listdir('split_files') if f.startswith('part_') and f.endswith('.wav')]
-
-	# 按编号排序文件列表
-	sorted_split_audio_files = sorted(split_audio_files, key=get_file_number)
-
-	return sorted_split_audio_files
+	digest = hashlib.sha256()
+	process = subprocess.Popen(fingerprint_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	for data in iter(lambda: process.stdout.read(PCM_READ_BYTES), b''):
+		digest.update(data)
+	process.stdout.close()
+	returncode = process.wait()
+	if returncode != 0:
+		raise subprocess.CalledProcessError(returncode,fingerprint_command)
+	return f'pcm:{digest.hexdigest()}'
 
 
 def seconds_to_hms(seconds):
@@ -83,17 +402,14 @@ def seconds_to_hms(seconds):
 	minutes, seconds = divmod(remainder, 60)
 	return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
 
-# 转为txt文件
-def segments_to_txt(segments,output_file,segment_idx):
-	with open(output_file,'w',encoding='utf8') as f:
-		for segment in segments:
-			# Converting start time to HH:MM:SS format
-			start_time = seconds_to_hms(segment.get('start')+300*segment_idx)
-			text = segment.get('text').strip()  # Removing any leading/trailing whitespaces from the text
-			f.write(f"{start_time}: {text}\n\n")
-	print(
-		f"Voila!✨ Transcript plain text file saved 👉 {output_file}"
-	)
+# 转为txt文本，segments 中的时间均为整段音频的绝对时间
+def segments_to_txt(segments):
+	lines = []
+	for segment in segments:
+		# Converting start time to HH:MM:SS format
+		start_time = seconds_to_hms(segment['start'])
+		lines.append(f"{start_time}: {segment['text']}\n\n")
+	return ''.join(lines)
 
 # Function to convert time in seconds to SRT time format
 def convert_to_srt_time(timestamp):
@@ -103,98 +419,353 @@ def convert_to_srt_time(timestamp):
 	milliseconds = int((timestamp % 1) * 1000)
 	return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
 
-# 转为srt文件
-def segments_to_srt(segments,output_file,segment_idx):
-	with open(output_file,'w',encoding='utf8') as f:
-		for idx,segment in enumerate(segments):
-			# Converting start time to HH:MM:SS format
-			start_time = convert_to_srt_time(segment.get('start')+300*segment_idx)
-			end_time = convert_to_srt_time(segment.get('end')+300*segment_idx)
-			text = segment.get('text').strip()  # Removing any leading/trailing whitespaces from the text
-			f.write(f"{idx + 1}\n{start_time} --> {end_time}\n{text}\n\n")
-	print(
-		f"Voila!✨ Srt file saved 👉 {output_file}"
-	)
-
-
-def transcript(filename):
-
-	client = Groq(api_key=st.secrets['GROQ_API_KEY'])
-	segment_idx = int(get_file_number(filename))
-
-	# filename = os.path.join(os.getcwd(),filename)
-	
-	with open(filename, "rb") as file:
-		transcription = client.audio.transcriptions.create(
-		  file=(filename, file.read()),
-		  model="whisper-large-v3",
-	#	  prompt="Specify context or spelling",  # Optional
-		  response_format="verbose_json",  # Optional
-		  # language="en",  # Optional
-		  temperature=0.0  # Optional
-		)
-	segments = transcription.segments
-
-	srt_output_file = filename.replace('.wav','.srt')
-
-	txt_output_file = filename.replace('.wav','.txt')
-
-	segments_to_srt(segments,srt_output_file,segment_idx)
-
-	segments_to_txt(segments,txt_output_file,segment_idx)
-	
-	return srt_output_file,txt_output_file
-
-
-def process_files_concurrently(file_list,merged_filename):
-	max_workers = 20  # 最大并行任务数
-	delay_between_requests = 4  # 每分钟最多20个请求，计算得每3秒一个请求
-	
-	# file_list = [os.path.join(os.getcwd(),file) for file in file_list]
-	# 定义存储结果的字典
-	results = {}
-
-	# 使用ThreadPoolExecutor进行并行处理
-	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-		future_to_filename = {executor.submit(transcript, filename): filename for filename in file_list}
-		
-		for future in concurrent.futures.as_completed(future_to_filename):
-			filename = future_to_filename[future]
+# 转为srt文本，字幕编号在整个文件中连续递增
+def segments_to_srt(segments):
+	cues = []
+	for idx,segment in enumerate(segments):
+		start_time = convert_to_srt_time(segment['start'])
+		end_time = convert_to_srt_time(segment['end'])
+		cues.append(f"{idx + 1}\n{start_time} --> {end_time}\n{segment['text']}\n\n")
+	return ''.join(cues)
+
+TRANSCRIPT_FORMATS = {
+	'srt': segments_to_srt,
+	'txt': segments_to_txt,
+}
+
+def save_transcripts(segments,merged_filename,formats=('srt','txt')):
+	# 每种格式只渲染并写入一次，返回 {格式: 文件路径}
+	outputs = {}
+	for fmt in formats:
+		output_file = os.path.splitext(merged_filename)[0] + '.' + fmt
+		with open(output_file,'w',encoding='utf8') as f:
+			f.write(TRANSCRIPT_FORMATS[fmt](segments))
+		logger.info(f"Voila!✨ {fmt} file saved 👉 {output_file}")
+		outputs[fmt] = output_file
+	return outputs
+
+
+# 进程内所有会话共享同一个密钥池，每个密钥单独限流，默认额度为 Groq whisper-large-v3 免费额度；
+# 配置 GROQ_API_KEYS（列表或逗号分隔）时使用多个密钥，否则使用 GROQ_API_KEY。
+# 限流额度保存在任务队列的数据库中，多个 worker 进程共用同一份额度
+_groq_key_pool = None
+_groq_key_pool_lock = threading.Lock()
+
+def get_groq_key_pool():
+	global _groq_key_pool
+	with _groq_key_pool_lock:
+		if _groq_key_pool is None:
+			keys = st.secrets.get('GROQ_API_KEYS') or [st.secrets['GROQ_API_KEY']]
+			if isinstance(keys,str):
+				keys = [key.strip() for key in keys.split(',') if key.strip()]
+			_groq_key_pool = ApiKeyPool(
+				list(keys),
+				requests_per_minute=int(st.secrets.get('groq_requests_per_minute',20)),
+				audio_seconds_per_hour=int(st.secrets.get('groq_audio_seconds_per_hour',7200)),
+				store=RateLimitStore(st.secrets.get('job_db_path',JOB_DB_PATH)),
+			)
+			logger.info(f"groq key pool ready with {len(_groq_key_pool.keys)} keys")
+		return _groq_key_pool
+
+
+# 进程内共享的事件循环和 HTTP 连接池：所有会话、所有密钥的分片请求复用同一个长连接池，
+# 不再为每个分片新建客户端和线程；GROQ_MAX_IN_FLIGHT 为整个进程同时在途的请求上限
+GROQ_MAX_IN_FLIGHT = 64
+_engine = None
+_engine_lock = threading.Lock()
+_groq_clients = {}
+
+def get_engine():
+	"""Return the process-wide (loop, http_client, in_flight semaphore)."""
+	global _engine
+	loop = get_loop()
+	with _engine_lock:
+		if _engine is None:
+			max_in_flight = int(st.secrets.get('groq_max_in_flight',GROQ_MAX_IN_FLIGHT))
+			http_client = httpx.AsyncClient(
+				limits=httpx.Limits(max_connections=max_in_flight,max_keepalive_connections=max_in_flight),
+				timeout=httpx.Timeout(600,connect=10),
+			)
+			_engine = (loop,http_client,asyncio.Semaphore(max_in_flight))
+		return _engine
+
+def get_groq_client(api_key):
+	# 每个密钥一个 AsyncGroq 客户端，共享同一个连接池
+	_,http_client,_ = get_engine()
+	with _engine_lock:
+		if api_key.key not in _groq_clients:
+			# 重试由 transcript_with_retry 统一控制，关闭 SDK 自带的重试
+			_groq_clients[api_key.key] = AsyncGroq(api_key=api_key.key,max_retries=0,http_client=http_client)
+		return _groq_clients[api_key.key]
+
+
+# 分片级结果缓存：任务失败重跑或恢复时，已完成的分片不再重复上传
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+
+def get_chunk_cache():
+	global _chunk_cache
+	with _chunk_cache_lock:
+		if _chunk_cache is None:
+			_chunk_cache = TranscriptCache(root=os.path.join(st.secrets.get('transcript_cache_dir',TRANSCRIPT_CACHE_DIR),'chunks'))
+		return _chunk_cache
+
+def chunk_cache_key(chunk,options,backend):
+	# 以分片 PCM 的哈希、编码方式、后端和模型参数作为键，与分片在整段音频中的位置无关
+	return transcript_cache_key(f"chunk:{chunk['sha256']}",{
+		'backend': backend.name,
+		'model': backend.model_name(options),
+		'temperature': options['temperature'],
+		'language': options.get('language'),
+		'codec': chunk['codec'],
+	})
+
+def map_time(time_map,t,tempo=1.0):
+	# 按分片的时间映射，把分片内时间还原为原音频时间
+	rel,original = time_map[bisect.bisect_right(time_map,[t,math.inf]) - 1]
+	return original + (t - rel) * tempo
+
+def to_absolute(segments,chunk):
+	# 转为整段音频的绝对时间，变速过的分片按倍数还原，开始和结束时间都不超过分片末尾
+	tempo = chunk.get('tempo',1.0)
+	if 'time_map' in chunk:
+		to_original = functools.partial(map_time,chunk['time_map'],tempo=tempo)
+	else:
+		to_original = lambda t: chunk['start'] + t * tempo
+	return [{
+		'start': min(to_original(segment['start']),chunk['end']),
+		'end': min(to_original(segment['end']),chunk['end']),
+		'text': segment['text'],
+	} for segment in segments]
+
+
+class GroqBackend(TranscriptionBackend):
+	"""Groq's hosted Whisper, sharing the process-wide connection pool, key pool and in-flight cap."""
+
+	name = 'groq'
+	seconds_per_audio_second = 0.02
+	capacity = GROQ_MAX_IN_FLIGHT
+
+	def estimated_wait(self,audio_seconds):
+		return get_groq_key_pool().wait_time(audio_seconds)
+
+	async def transcribe(self,chunk,options):
+		# 在线程中从内存映射编码，不阻塞事件循环；编码后超过上传限制时分成几段依次上传
+		samples = chunk_samples(chunk)
+		parts = await asyncio.to_thread(encode_for_upload,samples,chunk['codec'])
+		ends = [offset for offset,_ in parts[1:]] + [len(samples)]
+		segments = []
+		for (offset,buffer),end in zip(parts,ends):
+			part_segments = await self.request(chunk_name(chunk),buffer,(end - offset) / SAMPLE_RATE,options)
+			segments += [{**segment,'start': segment['start'] + offset / SAMPLE_RATE,'end': segment['end'] + offset / SAMPLE_RATE} for segment in part_segments]
+		return segments
+
+	async def request(self,filename,buffer,audio_seconds,options):
+		_,_,in_flight = get_engine()
+		key_pool = get_groq_key_pool()
+
+		async with in_flight:
+			while True:
+				# 在真正发出请求之前，从当前负载最低的密钥上占用限流额度
+				api_key = await key_pool.acquire_async(audio_seconds)
+				try:
+					buffer.seek(0)
+					response = await get_groq_client(api_key).audio.transcriptions.with_raw_response.create(
+					  file=(filename, buffer),
+					  model=options['model'],
+				#	  prompt="Specify context or spelling",  # Optional
+					  response_format="verbose_json",  # Optional
+					  **({'language': options['language']} if options.get('language') else {}),
+					  temperature=options['temperature']  # Optional
+					)
+				except APIStatusError as exc:
+					await key_pool.report_error_async(api_key,exc.status_code,exc.response.headers)
+					# 429/401 时该密钥已被剔除，还有其他可用密钥就立即换一个重发
+					if exc.status_code in (401,429) and key_pool.has_other_key(api_key):
+						continue
+					raise
+				finally:
+					key_pool.release(api_key)
+				break
+		await key_pool.update_from_headers_async(api_key,response.headers)
+		transcription = response.parse()
+
+		return [{
+			'start': segment['start'],
+			'end': segment['end'],
+			'text': segment['text'].strip(),
+		} for segment in transcription.segments]
+
+
+async def transcript(chunk,options=DEFAULT_TRANSCRIPT_OPTIONS):
+
+	backend = get_backend(options.get('backend','groq'))
+	chunk_cache = get_chunk_cache()
+	cache_key = chunk_cache_key(chunk,options,backend)
+	segments = chunk_cache.get(cache_key)
+	if segments is None:
+		# 缓存分片内的相对时间
+		segments = await backend.transcribe(chunk,options)
+		chunk_cache.put(cache_key,segments)
+	return to_absolute(segments,chunk)
+
+
+# 单个分片的最大尝试次数，以及退避时间的基数和上限（秒）
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 60
+# 第一轮全部完成后，对失败分片整体重跑的轮数
+RETRY_ROUNDS = 1
+
+
+def is_retryable(exc):
+	# 连接错误（含超时）、429 和 5xx 值得重试，其余错误（如 400/401）重试也不会成功
+	if isinstance(exc,(APIConnectionError,RateLimitError)):
+		return True
+	if isinstance(exc,APIStatusError):
+		return exc.status_code >= 500 or exc.status_code == 408
+	return False
+
+def retry_delay(exc,attempt):
+	# 服务端给出 retry-after 时以其为准，否则使用带抖动的指数退避
+	if isinstance(exc,APIStatusError):
+		retry_after = parse_reset_duration(exc.response.headers.get('retry-after'))
+		if retry_after:
+			return retry_after + random.uniform(0,1)
+	return random.uniform(0,min(RETRY_MAX_DELAY,RETRY_BASE_DELAY * 2**attempt))
+
+async def transcript_with_retry(chunk,options=DEFAULT_TRANSCRIPT_OPTIONS,max_attempts=MAX_ATTEMPTS):
+	for attempt in range(max_attempts):
+		try:
+			return await transcript(chunk,options)
+		except Exception as exc:
+			if attempt == max_attempts - 1 or not is_retryable(exc):
+				raise
+			delay = retry_delay(exc,attempt)
+			logger.warning(f"{chunk_name(chunk)} attempt {attempt + 1} failed ({exc}), retrying in {delay:.1f}s")
+			await asyncio.sleep(delay)
+
+
+def iter_transcribed_chunks(chunks,options=DEFAULT_TRANSCRIPT_OPTIONS,user='anonymous',priority=0):
+	"""Yield (chunk, segments) for each chunk as soon as it is transcribed, in completion order.
+
+	chunks may be a generator such as iter_chunks(); it is consumed on a
+	background thread, so finished chunks are yielded while the rest of the file
+	is still decoding. Chunks go through the process-wide scheduler, which
+	shares capacity fairly between users and runs lower `priority` values
+	first. Chunks that still fail after all retry rounds are yielded last with
+	segments=None.
+	"""
+	scheduler = get_scheduler()
+	done = queue.Queue()
+	feed_finished = object()
+	submitted = [0]
+	futures = []
+	# 调用方提前结束后不再提交新的分片
+	stop = threading.Event()
+	submit_lock = threading.Lock()
+
+	# 并发由全局调度器控制，请求的发出节奏由共享限流器控制
+	try:
+		def submit(chunk):
+			with submit_lock:
+				if stop.is_set():
+					return
+				submitted[0] += 1
+				future = scheduler.submit(lambda: transcript_with_retry(chunk,options),user=user,priority=priority)
+				futures.append(future)
+			future.add_done_callback(lambda f: done.put((chunk, f)))
+
+		def feed():
+			# 分片一产生就提交；停止后关闭分片生成器，iter_chunks 随之结束 ffmpeg
 			try:
-				srt_file, txt_file = future.result()
-				results[filename] = (srt_file, txt_file)
+				for chunk in chunks:
+					if stop.is_set():
+						break
+					submit(chunk)
 			except Exception as exc:
-				print(f'{filename} generated an exception: {exc}')
-			time.sleep(delay_between_requests)
-
-	# 根据输入文件列表顺序获取结果
-	srt_files = [results[filename][0] for filename in file_list]
-	txt_files = [results[filename][1] for filename in file_list]
-	
-	print(f'check str files order: {srt_files}')
-	print(f'check txt files order: {txt_files}')
-	
-	# 合并SRT和TXT文件
-	merged_srt_file = os.path.splitext(merged_filename)[0] + '.srt'
-	merged_txt_file = os.path.splitext(merged_filename)[0] + '.txt'
-
-	with open(merged_srt_file, 'w') as srt_out:
-		for srt_file in srt_files:
-			with open(srt_file, 'r') as srt_in:
-				srt_out.write(srt_in.read() + '\n')
-
-	with open(merged_txt_file, 'w') as txt_out:
-		for txt_file in txt_files:
-			with open(txt_file, 'r') as txt_in:
-				txt_out.write(txt_in.read() + '\n')
-
-	return merged_srt_file, merged_txt_file
+				done.put((feed_finished, exc))
+				return
+			finally:
+				if hasattr(chunks,'close'):
+					chunks.close()
+			done.put((feed_finished, None))
+
+		threading.Thread(target=feed,daemon=True).start()
+
+		feeding = True
+		received = 0
+		round_idx = 0
+		failed = []
+		while True:
+			if not feeding and received == submitted[0]:
+				# 本轮全部完成后，对失败的分片整体重跑
+				if failed and round_idx < RETRY_ROUNDS:
+					round_idx += 1
+					logger.info(f"retry round {round_idx}: re-running {len(failed)} failed chunks")
+					retry_chunks, failed = failed, []
+					for chunk in retry_chunks:
+						submit(chunk)
+					continue
+				break
+
+			chunk, payload = done.get()
+			if chunk is feed_finished:
+				feeding = False
+				if payload is not None:
+					raise payload
+				continue
+
+			received += 1
+			try:
+				segments = payload.result()
+			except ApiKeysUnauthorizedError:
+				# 所有密钥都鉴权失败，重试也不会成功，整个任务直接失败
+				raise
+			except Exception as exc:
+				logger.error(f"{chunk_name(chunk)} generated an exception: {exc}")
+				failed.append(chunk)
+				continue
+			yield chunk, segments
+	finally:
+		# 调用方提前结束迭代或出错时，停止提交并取消尚未完成的请求
+		with submit_lock:
+			stop.set()
+		for future in futures:
+			future.cancel()
+
+	for chunk in failed:
+		yield chunk, None
+
+
+def process_files_concurrently(chunks,options=DEFAULT_TRANSCRIPT_OPTIONS,on_chunk=None,user='anonymous',priority=0):
+	"""Transcribe all chunks and merge their segments in memory.
+
+	chunks may be a generator such as iter_chunks(); each chunk is submitted as
+	soon as it is produced. on_chunk(chunk, segments) is called in the caller's
+	thread as each chunk completes. user and priority are passed to the
+	process-wide scheduler. Returns (segments, missing_ranges): segments
+	carry absolute start/end times, ready for save_transcripts(). Chunks that
+	still fail after retries are left out and reported in missing_ranges as
+	(start, end) seconds, so the chunks that succeeded are kept.
+	"""
+	# 定义存储结果的字典
+	results = {}
+	failed = []
 
+	for chunk, segments in iter_transcribed_chunks(chunks,options,user,priority):
+		if segments is None:
+			failed.append(chunk)
+			continue
+		results[chunk['index']] = segments
+		if on_chunk:
+			on_chunk(chunk,segments)
 
+	missing_ranges = [(chunk['start'],chunk['end']) for chunk in sorted(failed,key=lambda c: c['index'])]
+	if missing_ranges:
+		logger.error(f"transcription still missing for: {[(seconds_to_hms(s),seconds_to_hms(e)) for s,e in missing_ranges]}")
 
-# sorted_split_audio_files = split_audio(audio_file)
+	# 按分片顺序合并结果，失败的分片跳过
+	segments = [segment for idx in sorted(results) for segment in results[idx]]
 
-# def wrap_transcript_audio(audio_file):
-#   sorted_split_audio_files = split_audio(audio_file)
-#   merged_srt, merged_txt = process_files_concurrently(sorted_split_audio_files)
-#   return merged_srt,merged_txt
+	return segments, missing_ranges
@@ -0,0 +1,247 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import contextlib
+import streamlit as st
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 任务队列数据库路径；运行中的任务超过 JOB_STALE_SECONDS 没有心跳，视为所在 worker 已退出
+JOB_DB_PATH = 'jobs.sqlite3'
+JOB_STALE_SECONDS = 120
+JOB_MAX_ATTEMPTS = 3
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id TEXT PRIMARY KEY,
+	user TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	status TEXT NOT NULL DEFAULT 'queued',
+	progress REAL NOT NULL DEFAULT 0,
+	message TEXT NOT NULL DEFAULT '',
+	preview TEXT NOT NULL DEFAULT '',
+	result TEXT,
+	error TEXT,
+	worker TEXT,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	created_at REAL NOT NULL,
+	started_at REAL,
+	finished_at REAL,
+	heartbeat REAL,
+	dedup_key TEXT,
+	leader TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, created_at);
+CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, status);
+CREATE TABLE IF NOT EXISTS job_stages (
+	job_id TEXT NOT NULL,
+	stage TEXT NOT NULL,
+	artifacts TEXT NOT NULL,
+	completed_at REAL NOT NULL,
+	PRIMARY KEY (job_id, stage)
+);
+"""
+
+
+class JobQueue:
+	"""Persistent transcription job queue in a local SQLite database.
+
+	The web app enqueues jobs and polls their status; worker processes claim
+	queued jobs, report progress and store the result. Each call opens its own
+	connection, so one queue object can be shared by threads and the database
+	by processes. A running job whose worker stops sending heartbeats is put
+	back in the queue, up to `max_attempts` times. Completed pipeline stages
+	and their artifacts are kept in `job_stages`, so the next worker resumes
+	the job instead of starting over.
+
+	Jobs enqueued with the same `dedup_key` while an earlier one is still
+	queued or running are not run again: they are attached to that job
+	(status 'attached') and report its progress and result.
+	"""
+
+	def __init__(self,path=JOB_DB_PATH,stale_seconds=JOB_STALE_SECONDS,max_attempts=JOB_MAX_ATTEMPTS):
+		self.path = path
+		self.stale_seconds = stale_seconds
+		self.max_attempts = max_attempts
+		with self._connect() as conn:
+			conn.execute('PRAGMA journal_mode=WAL')
+			# 旧版本创建的表缺少后来增加的列
+			columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+			for column in ('dedup_key','leader'):
+				if columns and column not in columns:
+					conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+			conn.executescript(JOB_SCHEMA)
+
+	@contextlib.contextmanager
+	def _connect(self):
+		conn = sqlite3.connect(self.path,timeout=30,isolation_level=None)
+		conn.row_factory = sqlite3.Row
+		try:
+			yield conn
+		finally:
+			conn.close()
+
+	@contextlib.contextmanager
+	def _transaction(self):
+		# BEGIN IMMEDIATE 立即获取写锁，保证多个 worker 不会领取到同一个任务
+		with self._connect() as conn:
+			conn.execute('BEGIN IMMEDIATE')
+			try:
+				yield conn
+			except BaseException:
+				conn.execute('ROLLBACK')
+				raise
+			conn.execute('COMMIT')
+
+	def _decode(self,row):
+		if row is None:
+			return None
+		job = dict(row)
+		job['payload'] = json.loads(job['payload'])
+		job['result'] = json.loads(job['result']) if job['result'] else None
+		return job
+
+	def enqueue(self,kind,payload,user='anonymous',dedup_key=None):
+		job_id = uuid.uuid4().hex
+		with self._transaction() as conn:
+			leader = None
+			if dedup_key:
+				# 相同来源和参数的任务正在排队或运行时，挂到该任务上等待结果
+				row = conn.execute(
+					"SELECT id FROM jobs WHERE dedup_key=? AND status IN ('queued','running') AND leader IS NULL LIMIT 1",
+					(dedup_key,),
+				).fetchone()
+				leader = row['id'] if row else None
+			conn.execute(
+				'INSERT INTO jobs (id,user,kind,payload,created_at,dedup_key,leader,status) VALUES (?,?,?,?,?,?,?,?)',
+				(job_id,user,kind,json.dumps(payload,ensure_ascii=False),time.time(),dedup_key,leader,'attached' if leader else 'queued'),
+			)
+		if leader:
+			logger.info(f"job {job_id} for {user} attached to running job {leader}")
+		else:
+			logger.info(f"job {job_id} queued: {kind} for {user}")
+		return job_id
+
+	def requeue_stale(self,conn):
+		deadline = time.time() - self.stale_seconds
+		conn.execute(
+			"UPDATE jobs SET status='error', error='worker stopped responding', finished_at=? "
+			"WHERE status='running' AND heartbeat<? AND attempts>=?",
+			(time.time(),deadline,self.max_attempts),
+		)
+		requeued = conn.execute(
+			"UPDATE jobs SET status='queued', worker=NULL WHERE status='running' AND heartbeat<?",
+			(deadline,),
+		).rowcount
+		if requeued:
+			logger.warning(f"{requeued} stale job(s) put back in the queue")
+
+	def claim(self,worker_id):
+		"""Mark the next queued job as running on `worker_id` and return it, or None if the queue is empty."""
+		with self._transaction() as conn:
+			self.requeue_stale(conn)
+			# 正在运行任务最少的用户优先，同一用户内先到先得
+			row = conn.execute(
+				"SELECT * FROM jobs AS q WHERE status='queued' ORDER BY "
+				"(SELECT COUNT(*) FROM jobs AS r WHERE r.user=q.user AND r.status='running'), created_at LIMIT 1"
+			).fetchone()
+			if row is None:
+				return None
+			now = time.time()
+			conn.execute(
+				"UPDATE jobs SET status='running', worker=?, attempts=attempts+1, started_at=?, heartbeat=? WHERE id=?",
+				(worker_id,now,now,row['id']),
+			)
+		job = self._decode(row)
+		job['status'] = 'running'
+		return job
+
+	def heartbeat(self,job_id):
+		with self._transaction() as conn:
+			conn.execute("UPDATE jobs SET heartbeat=? WHERE id=? AND status='running'",(time.time(),job_id))
+
+	def report(self,job_id,progress=None,message=None,preview=None):
+		fields = {'heartbeat': time.time()}
+		if progress is not None:
+			fields['progress'] = progress
+		if message is not None:
+			fields['message'] = message
+		if preview is not None:
+			fields['preview'] = preview
+		with self._transaction() as conn:
+			conn.execute(
+				f"UPDATE jobs SET {','.join(f'{name}=?' for name in fields)} WHERE id=?",
+				(*fields.values(),job_id),
+			)
+
+	def finish(self,job_id,result):
+		# 挂在该任务上的重复任务一起结束
+		with self._transaction() as conn:
+			conn.execute(
+				"UPDATE jobs SET status='done', progress=1, result=?, finished_at=? WHERE id=? OR leader=?",
+				(json.dumps(result,ensure_ascii=False),time.time(),job_id,job_id),
+			)
+		logger.info(f"job {job_id} done")
+
+	def fail(self,job_id,error):
+		with self._transaction() as conn:
+			conn.execute(
+				"UPDATE jobs SET status='error', error=?, finished_at=? WHERE id=? OR leader=?",
+				(str(error),time.time(),job_id,job_id),
+			)
+		logger.error(f"job {job_id} failed: {error}")
+
+	def complete_stage(self,job_id,stage,artifacts):
+		with self._transaction() as conn:
+			conn.execute(
+				'INSERT OR REPLACE INTO job_stages (job_id,stage,artifacts,completed_at) VALUES (?,?,?,?)',
+				(job_id,stage,json.dumps(artifacts,ensure_ascii=False),time.time()),
+			)
+
+	def stages(self,job_id):
+		# 已完成的阶段及其产物，例如 {'probe': {...}, 'transcribe:3': {...}}
+		with self._connect() as conn:
+			rows = conn.execute('SELECT stage,artifacts FROM job_stages WHERE job_id=?',(job_id,)).fetchall()
+		return {row['stage']: json.loads(row['artifacts']) for row in rows}
+
+	def get(self,job_id):
+		with self._connect() as conn:
+			job = self._decode(conn.execute('SELECT * FROM jobs WHERE id=?',(job_id,)).fetchone())
+			if job and job['status'] == 'attached':
+				# 重复任务显示所挂任务的状态、进度和结果
+				leader = self._decode(conn.execute('SELECT * FROM jobs WHERE id=?',(job['leader'],)).fetchone())
+				if leader:
+					for field in ('status','progress','message','preview','result','error'):
+						job[field] = leader[field]
+			return job
+
+	def active_for_user(self,user):
+		# 页面刷新或重新打开后，找回该用户仍在排队或运行的任务
+		with self._connect() as conn:
+			row = conn.execute(
+				"SELECT id FROM jobs WHERE user=? AND status IN ('queued','running','attached') ORDER BY created_at DESC LIMIT 1",
+				(user,),
+			).fetchone()
+		job = self.get(row['id']) if row else None
+		return job if job and job['status'] in ('queued','running') else None
+
+
+# 进程内共享的任务队列
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+	global _job_queue
+	with _job_queue_lock:
+		if _job_queue is None:
+			_job_queue = JobQueue(
+				path=st.secrets.get('job_db_path',JOB_DB_PATH),
+				stale_seconds=int(st.secrets.get('job_stale_seconds',JOB_STALE_SECONDS)),
+			)
+		return _job_queue
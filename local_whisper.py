@@ -0,0 +1,84 @@
+import os
+import asyncio
+import multiprocessing
+import concurrent.futures
+import logging
+import numpy as np
+from backends import TranscriptionBackend
+
+
+logger = logging.getLogger(__name__)
+
+# 本地 CPU 转录使用的 faster-whisper 模型和量化方式
+LOCAL_WHISPER_MODEL = 'medium'
+LOCAL_WHISPER_COMPUTE_TYPE = 'int8'
+
+
+# 工作进程内常驻的模型缓存，每个进程只加载一次模型
+_models = {}
+
+def load_model(model_size,compute_type=LOCAL_WHISPER_COMPUTE_TYPE,cpu_threads=0):
+	key = (model_size,compute_type)
+	if key not in _models:
+		# faster-whisper 只在启用本地引擎时才需要安装
+		from faster_whisper import WhisperModel
+		logger.info(f"loading faster-whisper model {model_size} ({compute_type}) in process {os.getpid()}")
+		_models[key] = WhisperModel(model_size,device='cpu',compute_type=compute_type,cpu_threads=cpu_threads)
+	return _models[key]
+
+def transcribe_pcm(pcm_file,offset,count,model_size,compute_type,cpu_threads,language=None,temperature=0.0):
+	# 在工作进程中运行：直接内存映射 16kHz 单声道 PCM 中的分片，不经过编码和解码
+	model = load_model(model_size,compute_type,cpu_threads)
+	samples = np.memmap(pcm_file,dtype=np.int16,mode='r',offset=offset*2,shape=(count,))
+	audio = samples.astype(np.float32) / 32768.0
+	segments,info = model.transcribe(audio,language=language,temperature=temperature)
+	return [{
+		'start': segment.start,
+		'end': segment.end,
+		'text': segment.text.strip(),
+	} for segment in segments]
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+	"""faster-whisper (CTranslate2, int8) on the local CPU.
+
+	Chunks are spread over a process pool whose workers load the model once at
+	start-up and keep it warm for the life of the process, so the backend works
+	without network access or Groq quota.
+	"""
+
+	name = 'local'
+	seconds_per_audio_second = 0.5
+
+	def __init__(self,model_size=LOCAL_WHISPER_MODEL,compute_type=LOCAL_WHISPER_COMPUTE_TYPE,processes=None):
+		cpu_count = os.cpu_count() or 1
+		self.model_size = model_size
+		self.compute_type = compute_type
+		self.processes = processes or max(1,cpu_count // 4)
+		self.cpu_threads = max(1,cpu_count // self.processes)
+		self.capacity = self.processes
+		# 使用 spawn 启动工作进程，避免 fork 带有多个线程的 Streamlit 进程
+		self.pool = concurrent.futures.ProcessPoolExecutor(
+			max_workers=self.processes,
+			mp_context=multiprocessing.get_context('spawn'),
+			initializer=load_model,
+			initargs=(self.model_size,self.compute_type,self.cpu_threads),
+		)
+
+	def model_name(self,options):
+		return f'faster-whisper-{self.model_size}-{self.compute_type}'
+
+	async def transcribe(self,chunk,options):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(
+			self.pool,
+			transcribe_pcm,
+			chunk['pcm'],
+			chunk['offset'],
+			chunk['samples'],
+			self.model_size,
+			self.compute_type,
+			self.cpu_threads,
+			options.get('language'),
+			options['temperature'],
+		)
@@ -0,0 +1,355 @@
+import os
+import json
+import struct
+import shutil
+import hashlib
+import threading
+import subprocess
+import collections
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 探测结果缓存的条目数，以及计算文件哈希时读取的首尾字节数
+PROBE_CACHE_SIZE = 256
+PROBE_HASH_BYTES = 1024 * 1024
+# 解析 WebM 头部时最多读取的字节数；MP4 的 moov 盒子可能在文件末尾，按盒子跳读，不受此限制
+PROBE_HEADER_BYTES = 4 * 1024 * 1024
+
+
+class MediaProbeError(Exception):
+	pass
+
+
+def media_info(duration=None,codec=None,sample_rate=None,channels=None,format=None):
+	return {'duration': duration, 'codec': codec, 'sample_rate': sample_rate, 'channels': channels, 'format': format}
+
+
+def probe_with_ffprobe(path):
+	command = [
+		'ffprobe',
+		'-v', 'error',
+		'-select_streams', 'a:0',
+		'-show_entries', 'format=duration,format_name:stream=codec_name,sample_rate,channels,duration',
+		'-of', 'json',
+		path
+	]
+	output = json.loads(subprocess.run(command,capture_output=True,check=True).stdout)
+	fmt = output.get('format',{})
+	streams = output.get('streams') or [{}]
+	stream = streams[0]
+	duration = fmt.get('duration') or stream.get('duration')
+	return media_info(
+		duration=float(duration) if duration not in (None,'N/A') else None,
+		codec=stream.get('codec_name'),
+		sample_rate=int(stream['sample_rate']) if stream.get('sample_rate') else None,
+		channels=stream.get('channels'),
+		format=fmt.get('format_name'),
+		)
+
+
+# ---------- WAV ----------
+
+WAV_CODECS = {1: 'pcm_s{bits}le', 3: 'pcm_f{bits}le', 6: 'pcm_alaw', 7: 'pcm_mulaw'}
+
+def parse_wav(f,size):
+	header = f.read(12)
+	if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+		return None
+	info = media_info(format='wav')
+	byte_rate = None
+	while True:
+		chunk = f.read(8)
+		if len(chunk) < 8:
+			break
+		chunk_id,chunk_size = struct.unpack('<4sI',chunk)
+		if chunk_id == b'fmt ':
+			fmt = f.read(chunk_size)
+			audio_format,channels,sample_rate,byte_rate,_,bits = struct.unpack('<HHIIHH',fmt[:16])
+			info.update(codec=WAV_CODECS.get(audio_format,'wav_{audio_format}').format(bits=bits,audio_format=audio_format),sample_rate=sample_rate,channels=channels)
+		elif chunk_id == b'data':
+			# 流式写出的 WAV 常把 data 长度写为 0 或 0xFFFFFFFF，此时按文件剩余长度计算
+			data_size = chunk_size if 0 < chunk_size <= size - f.tell() else size - f.tell()
+			if byte_rate:
+				info['duration'] = data_size / byte_rate
+			break
+		else:
+			f.seek(chunk_size + (chunk_size & 1),os.SEEK_CUR)
+	return info
+
+
+# ---------- MP3 ----------
+
+MP3_BITRATES = {
+	(1,1): [0,32,64,96,128,160,192,224,256,288,320,352,384,416,448],
+	(1,2): [0,32,48,56,64,80,96,112,128,160,192,224,256,320,384],
+	(1,3): [0,32,40,48,56,64,80,96,112,128,160,192,224,256,320],
+	(2,1): [0,32,48,56,64,80,96,112,128,144,160,176,192,224,256],
+	(2,2): [0,8,16,24,32,40,48,56,64,80,96,112,128,144,160],
+}
+MP3_SAMPLE_RATES = {1: [44100,48000,32000], 2: [22050,24000,16000], 2.5: [11025,12000,8000]}
+
+def parse_mp3_frame(header):
+	# 解析 4 字节帧头，返回 (版本, 层, 码率 kbps, 采样率, 声道数)，不是合法帧头时返回 None
+	b1,b2,b3,b4 = header
+	if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+		return None
+	version = {3: 1, 2: 2, 0: 2.5}.get((b2 >> 3) & 3)
+	layer = {3: 1, 2: 2, 1: 3}.get((b2 >> 1) & 3)
+	bitrate_index = b3 >> 4
+	rate_index = (b3 >> 2) & 3
+	if version is None or layer is None or bitrate_index in (0,15) or rate_index == 3:
+		return None
+	# MPEG-2/2.5 的第二、三层共用一张码率表
+	bitrate = MP3_BITRATES[(1,layer) if version == 1 else (2,1 if layer == 1 else 2)][bitrate_index]
+	channels = 1 if (b4 >> 6) == 3 else 2
+	return version,layer,bitrate,MP3_SAMPLE_RATES[version][rate_index],channels
+
+def parse_mp3(f,size):
+	head = f.read(10)
+	start = 0
+	if head[:3] == b'ID3':
+		# 跳过 ID3v2 标签，长度为 4 个 7 位的同步安全整数
+		start = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+	f.seek(start)
+	data = f.read(64 * 1024)
+	for offset in range(len(data) - 4):
+		frame = parse_mp3_frame(data[offset:offset+4])
+		if frame:
+			break
+	else:
+		return None
+	version,layer,bitrate,sample_rate,channels = frame
+	samples_per_frame = 384 if layer == 1 else 1152 if (layer == 2 or version == 1) else 576
+	info = media_info(codec=f'mp{layer}',sample_rate=sample_rate,channels=channels,format='mp3')
+
+	# VBR 文件的第一帧里有 Xing/Info 或 VBRI 头，记录了总帧数
+	side_info = (32 if channels == 2 else 17) if version == 1 else (17 if channels == 2 else 9)
+	xing = offset + 4 + side_info
+	if data[xing:xing+4] in (b'Xing',b'Info'):
+		flags = struct.unpack('>I',data[xing+4:xing+8])[0]
+		if flags & 1:
+			frames = struct.unpack('>I',data[xing+8:xing+12])[0]
+			info['duration'] = frames * samples_per_frame / sample_rate
+			return info
+	vbri = offset + 4 + 32
+	if data[vbri:vbri+4] == b'VBRI':
+		frames = struct.unpack('>I',data[vbri+14:vbri+18])[0]
+		info['duration'] = frames * samples_per_frame / sample_rate
+		return info
+	# 固定码率：按音频数据长度和码率估算
+	info['duration'] = (size - start - offset) * 8 / (bitrate * 1000)
+	return info
+
+
+# ---------- MP4 / M4A ----------
+
+MP4_CONTAINERS = {b'moov',b'trak',b'mdia',b'minf',b'stbl',b'mvex'}
+MP4_CODECS = {b'mp4a': 'aac', b'Opus': 'opus', b'ac-3': 'ac3', b'ec-3': 'eac3', b'alac': 'alac', b'fLaC': 'flac', b'.mp3': 'mp3'}
+
+def iter_boxes(f,start,end):
+	# 按盒子头跳读，不读取盒子内容
+	offset = start
+	while offset + 8 <= end:
+		f.seek(offset)
+		header = f.read(8)
+		if len(header) < 8:
+			return
+		box_size,box_type = struct.unpack('>I4s',header)
+		header_size = 8
+		if box_size == 1:
+			box_size = struct.unpack('>Q',f.read(8))[0]
+			header_size = 16
+		elif box_size == 0:
+			box_size = end - offset
+		if box_size < header_size:
+			return
+		yield box_type,offset + header_size,offset + box_size
+		offset += box_size
+
+def parse_mp4(f,size):
+	f.seek(4)
+	if f.read(4) not in (b'ftyp',b'moov',b'free',b'mdat',b'wide',b'skip'):
+		return None
+	info = media_info(format='mp4')
+	state = {'timescale': None, 'handler': None}
+
+	def walk(start,end):
+		for box_type,body,box_end in iter_boxes(f,start,end):
+			f.seek(body)
+			if box_type in MP4_CONTAINERS:
+				walk(body,box_end)
+			elif box_type == b'mvhd':
+				version = f.read(1)[0]
+				f.seek(3,os.SEEK_CUR)
+				if version == 1:
+					_,_,timescale,duration = struct.unpack('>QQIQ',f.read(28))
+				else:
+					_,_,timescale,duration = struct.unpack('>IIII',f.read(16))
+				state['timescale'] = timescale
+				if duration and duration not in (0xFFFFFFFF,0xFFFFFFFFFFFFFFFF):
+					info['duration'] = duration / timescale
+			elif box_type == b'mehd' and not info['duration'] and state['timescale']:
+				# 分片 MP4（如 YouTube 的 DASH 音频）的总时长记录在 mvex/mehd 中
+				version = f.read(1)[0]
+				f.seek(3,os.SEEK_CUR)
+				duration = struct.unpack('>Q' if version == 1 else '>I',f.read(8 if version == 1 else 4))[0]
+				info['duration'] = duration / state['timescale']
+			elif box_type == b'hdlr':
+				state['handler'] = f.read(12)[8:12]
+			elif box_type == b'stsd' and state['handler'] == b'soun' and info['codec'] is None:
+				f.seek(8,os.SEEK_CUR)
+				entry = f.read(36)
+				if len(entry) == 36:
+					info['codec'] = MP4_CODECS.get(entry[4:8],entry[4:8].decode('latin1').strip())
+					info['channels'] = struct.unpack('>H',entry[24:26])[0]
+					info['sample_rate'] = struct.unpack('>I',entry[32:36])[0] >> 16
+
+	walk(0,size)
+	return info
+
+
+# ---------- WebM / Matroska ----------
+
+EBML_HEADER = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_CLUSTER = 0x1F43B675
+MKV_MASTERS = {MKV_SEGMENT,0x1549A966,0x1654AE6B,0xAE,0xE1}  # Segment, Info, Tracks, TrackEntry, Audio
+MKV_CODECS = {'A_OPUS': 'opus', 'A_VORBIS': 'vorbis', 'A_AAC': 'aac', 'A_MPEG/L3': 'mp3', 'A_FLAC': 'flac'}
+
+def read_vint(data,pos,keep_marker):
+	first = data[pos]
+	length = 1
+	while length <= 8 and not first & (0x80 >> (length - 1)):
+		length += 1
+	if length > 8 or pos + length > len(data):
+		raise ValueError("invalid EBML variable-length integer")
+	value = first if keep_marker else first & (0xFF >> length)
+	for byte in data[pos+1:pos+length]:
+		value = (value << 8) | byte
+	unknown = not keep_marker and value == (1 << (7 * length)) - 1
+	return value,length,unknown
+
+def parse_webm(f,size):
+	data = f.read(PROBE_HEADER_BYTES)
+	if len(data) < 4 or struct.unpack('>I',data[:4])[0] != EBML_HEADER:
+		return None
+	info = media_info(format='webm')
+	timecode_scale = 1000000
+	duration = None
+	track = {}
+	audio_track = None
+
+	def walk(pos,end):
+		nonlocal timecode_scale,duration,track,audio_track
+		while pos < end:
+			element_id,id_length,_ = read_vint(data,pos,keep_marker=True)
+			element_size,size_length,unknown = read_vint(data,pos + id_length,keep_marker=False)
+			body = pos + id_length + size_length
+			body_end = len(data) if unknown else min(body + element_size,len(data))
+			if element_id == MKV_CLUSTER:
+				# 音频数据开始，头部信息已经读完
+				return False
+			if element_id in MKV_MASTERS:
+				if element_id == 0xAE:
+					track = {}
+				if walk(body,body_end) is False:
+					return False
+				if element_id == 0xAE and track.get('type') == 2 and audio_track is None:
+					audio_track = track
+			else:
+				payload = data[body:body_end]
+				if element_id == 0x2AD7B1:
+					timecode_scale = int.from_bytes(payload,'big')
+				elif element_id == 0x4489:
+					duration = struct.unpack('>f' if len(payload) == 4 else '>d',payload)[0]
+				elif element_id == 0x83:
+					track['type'] = int.from_bytes(payload,'big')
+				elif element_id == 0x86:
+					track['codec'] = payload.decode('ascii',errors='replace')
+				elif element_id == 0xB5:
+					track['sample_rate'] = struct.unpack('>f' if len(payload) == 4 else '>d',payload)[0]
+				elif element_id == 0x9F:
+					track['channels'] = int.from_bytes(payload,'big')
+			pos = body_end
+		return True
+
+	try:
+		walk(0,len(data))
+	except (ValueError,IndexError,struct.error):
+		pass
+	if duration is not None:
+		info['duration'] = duration * timecode_scale / 1e9
+	if audio_track:
+		info.update(
+			codec=MKV_CODECS.get(audio_track.get('codec'),audio_track.get('codec')),
+			sample_rate=int(audio_track['sample_rate']) if 'sample_rate' in audio_track else None,
+			channels=audio_track.get('channels'),
+			)
+	return info
+
+
+HEADER_PARSERS = [parse_wav,parse_mp4,parse_webm,parse_mp3]
+
+def probe_headers(path):
+	size = os.path.getsize(path)
+	with open(path,'rb') as f:
+		for parser in HEADER_PARSERS:
+			f.seek(0)
+			try:
+				info = parser(f,size)
+			except (ValueError,IndexError,struct.error):
+				info = None
+			if info is not None:
+				return info
+	return None
+
+
+def probe_cache_key(path,hash_bytes=PROBE_HASH_BYTES):
+	# 对文件大小和首尾各 1MB 求哈希，读取量与文件大小无关
+	size = os.path.getsize(path)
+	digest = hashlib.sha256(str(size).encode())
+	with open(path,'rb') as f:
+		digest.update(f.read(hash_bytes))
+		if size > 2 * hash_bytes:
+			f.seek(-hash_bytes,os.SEEK_END)
+			digest.update(f.read(hash_bytes))
+	return digest.hexdigest()
+
+
+# 进程内的探测结果缓存，按文件哈希索引，最近最少使用淘汰
+_probe_cache = collections.OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+def probe_media(path):
+	"""Read duration, codec, sample rate and channels of a media file from its headers.
+
+	Uses ffprobe when it is installed, otherwise the built-in WAV / MP3 /
+	MP4 / M4A / WebM header parsers; neither decodes the audio. Results are
+	cached by a hash of the file's size, head and tail. Values that cannot be
+	determined are None. Raises MediaProbeError for unrecognised files.
+	"""
+	key = probe_cache_key(path)
+	with _probe_cache_lock:
+		if key in _probe_cache:
+			_probe_cache.move_to_end(key)
+			return dict(_probe_cache[key])
+
+	info = None
+	if shutil.which('ffprobe'):
+		try:
+			info = probe_with_ffprobe(path)
+		except (subprocess.CalledProcessError,ValueError) as e:
+			logger.warning(f"ffprobe failed on {path}: {e}")
+	if info is None or info['duration'] is None:
+		info = probe_headers(path) or info
+	if info is None:
+		raise MediaProbeError(f"unrecognised media file: {path}")
+	logger.debug(f"probed {path}: {info}")
+
+	with _probe_cache_lock:
+		_probe_cache[key] = info
+		while len(_probe_cache) > PROBE_CACHE_SIZE:
+			_probe_cache.popitem(last=False)
+	return dict(info)
@@ -0,0 +1,470 @@
+import os
+import fcntl
+import re
+import json
+import math
+import time
+import shutil
+import functools
+import contextlib
+import mimetypes
+import subprocess
+import threading
+import concurrent.futures
+import streamlit as st
+import logging
+from supabase import create_client, StorageException
+from groq_whisper import iter_chunks,process_files_concurrently,save_transcripts,segments_to_txt,chunk_target_seconds,audio_fingerprint
+from workspace import JobWorkspace, WORKSPACE_ROOT
+from job_queue import JOB_DB_PATH
+from media_probe import probe_media, MediaProbeError
+from transcript_cache import TranscriptCache,SupabaseCacheTier,transcript_cache_key,youtube_video_id,file_fingerprint,TRANSCRIPT_CACHE_DIR,TRANSCRIPT_CACHE_MAX_BYTES
+from subtitle_translator import wrap_translate
+from youtube_ingest import YouTubeAudioStream, YOUTUBE_MIN_AUDIO_KBPS
+
+
+logger = logging.getLogger(__name__)
+
+
+# 转录流水线：下载、切分、转录、翻译、上传。只使用 st.secrets，不涉及页面元素，由 worker 进程调用
+
+def get_supabase_client():
+	url = st.secrets['supabase_url']
+	key = st.secrets['supabase_key']
+	supabase = create_client(url, key)
+	return supabase
+
+# check if file already exists
+def check_supabase_file_exists(file_path,bucket_name):
+	supabase = get_supabase_client()
+	supabase_storage_ls = supabase.storage.from_(bucket_name).list()
+
+	if any(file["name"] == os.path.basename(file_path) for file in supabase_storage_ls):
+		return True
+	else:
+		return False
+
+
+# user unicodedata to remove characters that are not ASCII
+def remove_non_ascii(text):
+	return ''.join(c for c in text if ord(c) < 128)
+
+def upload_file_to_supabase_storage(file_path):
+	base_name = remove_non_ascii(os.path.basename(file_path)).replace(' ', '_')
+	path_on_supastorage = os.path.splitext(base_name)[0] + '_' + str(round(time.time())//6000)  + os.path.splitext(base_name)[1]
+	mime_type, _ = mimetypes.guess_type(base_name)
+
+	supabase = get_supabase_client()
+	bucket_name = st.secrets["bucket_name"]
+
+	try:
+		if check_supabase_file_exists(path_on_supastorage,bucket_name):
+			public_url = supabase.storage.from_(bucket_name).get_public_url(path_on_supastorage)
+		else:
+			supabase.storage.from_(bucket_name).upload(file=file_path, path=path_on_supastorage, file_options={"content-type": mime_type})
+			public_url = supabase.storage.from_(bucket_name).get_public_url(path_on_supastorage)
+	except StorageException as e:
+		print("StorageException:", e)
+		raise
+	return public_url
+
+
+def save_kg_json():
+
+	# save kaggle.json
+	kaggle_json = {
+	"username":st.secrets["kaggle_username"],
+	"key":st.secrets["kaggle_api_key"]
+	}
+
+	kg_json_dir = os.path.expanduser('~/.kaggle')
+
+	mkdir_kaggle_json = subprocess.run(["mkdir","-p",kg_json_dir],check=True)
+
+	# save kaggle json file
+	with open(f'{kg_json_dir}/kaggle.json','w') as f:
+		json.dump(kaggle_json,f)
+
+	chmod = subprocess.run(["chmod","600",os.path.join(kg_json_dir, 'kaggle.json')],check=True)
+
+def set_notebook_dir(kg_notebook_dir):
+	# remove kg_notebook dir if exists
+	rm_kg_notebook = subprocess.run(["rm","-rf",kg_notebook_dir],check=True)
+
+	# create kg_notebook dir
+	mkdir_kg_notebook = subprocess.run(["mkdir","-p",kg_notebook_dir],check=True)
+
+def pull_and_run_notebook(notebook,kg_notebook_dir):
+	# pull notebook code and metadata
+	pull = subprocess.run(["kaggle","kernels","pull",notebook,"-p",kg_notebook_dir,"-m"],check=True)
+	# check notebook metadata
+	with open(os.path.join(kg_notebook_dir,'kernel-metadata.json')) as f:
+		kg_metadata = json.load(f)
+
+	# push notebook
+	kg_push = subprocess.run(["kaggle", "kernels", "push", "-p", kg_notebook_dir], check=True)
+	return kg_metadata
+
+def wait_for_kernel(notebook, interval=5):
+	# 轮询直到 notebook 运行结束，返回最终状态（complete 或 error）
+	while True:
+		result = subprocess.run(["kaggle", "kernels", "status", notebook], capture_output=True, text=True)
+		stdout = result.stdout
+		# 提取状态值
+		status = re.findall(r'status "(\w+)"',stdout)[0]
+		logger.info(f"The current status is: {status}")
+		if status in ("complete","error"):
+			return status
+		time.sleep(interval)
+
+def save_output(notebook,kg_notebook_output_dir):
+	# remove kg_notebook dir if exists
+	kg_rm_output = subprocess.run(["rm","-rf",kg_notebook_output_dir],check=True)
+	# create output dir
+	kg_mkdir_output = subprocess.run(["mkdir", "-p", kg_notebook_output_dir], check=True)
+	# save output
+	kg_save_output = subprocess.run(["kaggle", "kernels", "output", notebook, "-p", kg_notebook_output_dir], check=True)
+
+def check_dataset_status(dataset):
+	while True:
+		# get dataset creation status
+		dataset_status = subprocess.run(["kaggle","datasets","status",dataset],capture_output=True, text=True)
+		if dataset_status.stdout == 'ready':
+			print("New dataset is ready")
+			break
+		else:
+			print("New dataset is still updating...")
+			time.sleep(5)
+
+def update_youtu_url(url,kg_notebook_input_data_dir):
+	# prepare new data
+	youtube_url_file = 'youtube_url.txt'
+	youtube_url_file_path = os.path.join(kg_notebook_input_data_dir,youtube_url_file)
+
+	with open(youtube_url_file_path,'w') as f:
+		f.write(url)
+
+def update_kg_youtube_url(dataset,url,kg_notebook_input_data_dir):
+	# remove if exists
+	rm_dataset = subprocess.run(["rm","-rf",kg_notebook_input_data_dir],check=True)
+
+	# make dataset dir
+	dataset_mkdir = subprocess.run(["mkdir","-p",kg_notebook_input_data_dir],check=True)
+
+	# download metadata for an existing dataset
+	kg_dataset = subprocess.run(["kaggle","datasets","metadata","-p",kg_notebook_input_data_dir,dataset],check=True)
+
+	# update youtube url
+	update_youtu_url(url,kg_notebook_input_data_dir)
+
+	# create a new dataset version
+	kg_dataset_update = subprocess.run(["kaggle","datasets","version","-p",kg_notebook_input_data_dir,"-m","Updated data"])
+
+	# check dataset status
+	check_dataset_status(dataset)
+
+
+# Kaggle 下载使用固定的数据集、notebook 和输出目录，所有 worker 进程的任务需要依次运行：
+# 线程锁保证进程内互斥，任务数据库旁的文件锁保证进程间互斥
+_kaggle_lock = threading.Lock()
+
+@contextlib.contextmanager
+def kaggle_lock():
+	with _kaggle_lock, open(st.secrets.get('job_db_path',JOB_DB_PATH) + '.kaggle.lock','a') as lock_file:
+		fcntl.flock(lock_file,fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock_file,fcntl.LOCK_UN)
+
+def download_youtube(youtube_url,output_dir):
+	dataset_url = 'zluckyhou/youtube-url'
+	kg_notebook_input_data_dir_youtu = 'kg_notebook_input_data_url'
+	notebook_name_youtu = "zluckyhou/youtube-download"
+	kg_notebook_dir_youtu = 'kg_notebook_youtu'
+	kg_notebook_output_dir_youtu = 'kg_notebook_output_youtu'
+	with kaggle_lock():
+		update_kg_youtube_url(dataset_url,youtube_url,kg_notebook_input_data_dir_youtu)
+		# run youtube_download to get youtube video
+		set_notebook_dir(kg_notebook_dir_youtu)
+		pull_and_run_notebook(notebook_name_youtu,kg_notebook_dir_youtu)
+		status = wait_for_kernel(notebook_name_youtu, interval=5)
+		if status != "complete":
+			raise RuntimeError(f"youtube download notebook finished with status {status}")
+		save_output(notebook_name_youtu,kg_notebook_output_dir_youtu)
+		video_name = [file for file in os.listdir(kg_notebook_output_dir_youtu) if file.endswith('.mp4')][0]
+		# 移到任务自己的目录，避免被下一次下载清除
+		youtube_video = os.path.join(output_dir,video_name)
+		shutil.move(os.path.join(kg_notebook_output_dir_youtu,video_name),youtube_video)
+	logger.info(f"youtube video: {youtube_video}")
+	return youtube_video
+
+
+def download_preview(audio_stream):
+	# 预览视频只用于页面显示，下载失败不影响任务
+	try:
+		return audio_stream.download_preview()
+	except Exception as e:
+		logger.warning(f"preview download failed: {e}")
+		return None
+
+
+# 进程内共享的转录结果缓存，配置了 transcript_cache_table 时同时使用 Supabase 作为共享层
+_transcript_cache = None
+_transcript_cache_lock = threading.Lock()
+
+def get_transcript_cache():
+	global _transcript_cache
+	with _transcript_cache_lock:
+		if _transcript_cache is None:
+			remote = None
+			if st.secrets.get('transcript_cache_table'):
+				remote = SupabaseCacheTier(get_supabase_client,st.secrets['transcript_cache_table'])
+			_transcript_cache = TranscriptCache(
+				root=st.secrets.get('transcript_cache_dir',TRANSCRIPT_CACHE_DIR),
+				max_bytes=int(st.secrets.get('transcript_cache_max_bytes',TRANSCRIPT_CACHE_MAX_BYTES)),
+				remote=remote,
+				)
+		return _transcript_cache
+
+
+def chunk_progress(audio_length,codec,report):
+	# 返回 on_chunk 回调：按完成的分片数上报进度，并上报从 0 秒开始已经连续完成的转录文本
+	expected_chunks = math.ceil((audio_length or 0) / chunk_target_seconds(codec)) or 1
+	pending = {}
+	prefix = []
+	next_index = 0
+	completed = 0
+	max_index = 0
+
+	def on_chunk(chunk,segments):
+		nonlocal next_index,completed,max_index
+		completed += 1
+		max_index = max(max_index,chunk['index'])
+		pending[chunk['index']] = segments
+		total = max(expected_chunks,max_index + 1)
+		progress = min(completed / total,1.0)
+		message = f"Transcribed {completed}/{total} chunks"
+
+		if next_index not in pending:
+			report(progress=progress,message=message)
+			return
+		while next_index in pending:
+			prefix.extend(pending.pop(next_index))
+			next_index += 1
+		report(progress=progress,message=message,preview=segments_to_txt(prefix))
+
+	return on_chunk
+
+
+def transcribe_chunks(audio_file,options,workspace,stages,complete_stage,user='anonymous',priority=0,on_chunk=None,duration=None):
+	"""Split and transcribe audio_file, recording each finished chunk as a `transcribe:<index>` stage.
+
+	audio_file is a path or a byte stream still downloading (see iter_chunks).
+	Chunks already recorded in `stages` are not sent again. If the `split`
+	stage is recorded and the decoded PCM file is still in the workspace its
+	chunks are reused; otherwise the file is decoded again, which yields the
+	same chunks.
+	Returns (segments, missing_ranges) like process_files_concurrently().
+	"""
+	results = {}
+	for name,artifacts in stages.items():
+		if name.startswith('transcribe:'):
+			results[artifacts['chunk']['index']] = artifacts['segments']
+			if on_chunk:
+				on_chunk(artifacts['chunk'],artifacts['segments'])
+
+	split = stages.get('split')
+	if split and all(os.path.exists(chunk['pcm']) for chunk in split['chunks'] if chunk['index'] not in results):
+		chunks = split['chunks']
+	else:
+		def record_split(chunks):
+			recorded = []
+			# 提前关闭时一并关闭 iter_chunks，结束 ffmpeg 解码
+			with contextlib.closing(chunks):
+				for chunk in chunks:
+					recorded.append(chunk)
+					yield chunk
+			complete_stage('split',{'chunks':recorded})
+		# 解码与切分在一次 ffmpeg 调用中完成，分片一产生就开始转录
+		chunks = record_split(iter_chunks(
+			audio_file,workspace,codec=options['codec'],duration=duration,
+			remove_silence=options.get('remove_silence',False),tempo=options.get('tempo',1.0),
+		))
+	def untranscribed(chunks):
+		# 跳过已转录的分片；提前关闭时一并关闭上游的分片生成器
+		try:
+			for chunk in chunks:
+				if chunk['index'] not in results:
+					yield chunk
+		finally:
+			if hasattr(chunks,'close'):
+				chunks.close()
+	pending = untranscribed(chunks)
+
+	def on_transcribed(chunk,segments):
+		complete_stage(f"transcribe:{chunk['index']}",{'chunk':chunk,'segments':segments})
+		results[chunk['index']] = segments
+		if on_chunk:
+			on_chunk(chunk,segments)
+
+	if results:
+		logger.info(f"{len(results)} chunk(s) already transcribed, resuming")
+	logger.info("-----------Transcribing------------")
+	_, missing_ranges = process_files_concurrently(pending,options,on_chunk=on_transcribed,user=user,priority=priority)
+	segments = [segment for idx in sorted(results) for segment in results[idx]]
+	return segments,missing_ranges
+
+
+def run_job(job,queue):
+	"""Run one queued job end to end and return the result the page displays.
+
+	Each stage (download, probe, split, per-chunk transcribe, merge, translate,
+	upload) is recorded in the queue's stage table with its artifacts as soon
+	as it completes, and skipped when the job is picked up again after a
+	worker crash or restart. Intermediate files live in a workspace named
+	after the job so they survive a restart. Raises on failure; the worker
+	records the error.
+	"""
+	job_id = job['id']
+	report = functools.partial(queue.report,job_id)
+	stages = queue.stages(job_id)
+	if stages:
+		logger.info(f"job {job_id} resuming after stages: {sorted(stages)}")
+
+	def complete_stage(name,artifacts):
+		queue.complete_stage(job_id,name,artifacts)
+		stages[name] = artifacts
+
+	def run_stage(name,fn):
+		if name not in stages:
+			complete_stage(name,fn())
+		return stages[name]
+
+	payload = job['payload']
+	options = payload['options']
+	output_dir = payload['output_dir']
+	target_language = payload.get('target_language')
+	os.makedirs(output_dir,exist_ok=True)
+	cache = get_transcript_cache()
+
+	def start_download():
+		# 上传的文件已在本地；YouTube 音频返回 YouTubeAudioStream，边下载边解码转录
+		if job['kind'] != 'youtube':
+			# 按原始字节求哈希，无需在转录前完整解码一遍；页面保存上传文件时已经算过
+			return {'audio_file': payload['audio_file'], 'preview_file': None, 'source_id': payload.get('source_id') or file_fingerprint(payload['audio_file'])}
+		video_id = youtube_video_id(payload['youtube_url'])
+		source_id = f'youtube:{video_id}' if video_id else None
+		# 该视频已有转录结果时跳过下载
+		if source_id and cache.get(transcript_cache_key(source_id,options)) is not None:
+			return {'audio_file': None, 'preview_file': None, 'source_id': source_id}
+		report(message="Downloading audio...")
+		try:
+			return YouTubeAudioStream(payload['youtube_url'],output_dir,min_kbps=int(st.secrets.get('youtube_min_audio_kbps',YOUTUBE_MIN_AUDIO_KBPS)))
+		except Exception as e:
+			logger.warning(f"direct youtube download failed ({e}), falling back to kaggle")
+			audio_file = download_youtube(payload['youtube_url'],output_dir)
+			return {'audio_file': audio_file, 'preview_file': audio_file, 'source_id': source_id or audio_fingerprint(audio_file)}
+
+	audio_stream = None
+	if 'download' not in stages:
+		download = start_download()
+		if isinstance(download,YouTubeAudioStream):
+			audio_stream = download
+		else:
+			complete_stage('download',download)
+
+	def probe():
+		if audio_stream is not None:
+			return {'audio_length': audio_stream.duration, 'source_id': audio_stream.source_id}
+		audio_file = stages['download']['audio_file']
+		info = {}
+		if audio_file:
+			# 只读取文件头，不解码音频
+			try:
+				info = probe_media(audio_file)
+			except MediaProbeError as e:
+				logger.warning(f"{e}, transcribing without a known duration")
+		logger.debug(f"audio length: {info.get('duration')}")
+		return {
+			'audio_length': info.get('duration'),
+			'codec': info.get('codec'),
+			'sample_rate': info.get('sample_rate'),
+			'channels': info.get('channels'),
+			'source_id': stages['download']['source_id'],
+		}
+
+	audio_length = run_stage('probe',probe)['audio_length']
+	cache_key = transcript_cache_key(stages['probe']['source_id'],options)
+
+	preview = None
+	if audio_stream is not None:
+		audio_file = audio_stream.audio_file
+		audio_source = audio_stream
+		if payload.get('preview'):
+			# 预览视频在后台线程中下载，与转录并行
+			preview_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+			preview = preview_pool.submit(download_preview,audio_stream)
+			preview_pool.shutdown(wait=False)
+	else:
+		audio_file = audio_source = stages['download']['audio_file']
+	# 全局调度器按用户公平分配并发，同一用户内较短的音频优先
+	priority = audio_length or 0
+
+	# 中间文件写在以任务 id 命名的工作目录中，任务中断后重新领取时可以继续使用
+	workspace = JobWorkspace(job_id,root=st.secrets.get('job_workspace_dir',WORKSPACE_ROOT),persistent=True)
+	try:
+		def merge():
+			segments = cache.get(cache_key)
+			missing_ranges = []
+			if segments is None:
+				report(message="Transcribing...")
+				logger.info(f"audio file for transcript: {audio_file}")
+				# 快速模式下实际切分的时长缩短为原来的 1/tempo
+				on_chunk = chunk_progress((audio_length or 0) / options.get('tempo',1.0),options['codec'],report)
+				segments, missing_ranges = transcribe_chunks(audio_source,options,workspace,stages,complete_stage,user=job['user'],priority=priority,on_chunk=on_chunk,duration=audio_length)
+				# 只缓存完整的转录结果
+				if not missing_ranges:
+					cache.put(cache_key,segments)
+			# 合并结果写在会话目录中
+			merged_filename = os.path.join(output_dir,os.path.basename(audio_file) if audio_file else stages['probe']['source_id'].replace(':','_'))
+			outputs = save_transcripts(segments,merged_filename)
+			logger.info(f"srt file: {outputs['srt']}")
+			return {'srt_file': outputs['srt'], 'txt_file': outputs['txt'], 'missing_ranges': missing_ranges}
+
+		merged = run_stage('merge',merge)
+	finally:
+		# 正常结束或失败时清理；进程崩溃时保留，供重新领取后继续
+		workspace.cleanup()
+
+	if audio_stream is not None:
+		# 转录结束、音频已完整下载后才记录 download 阶段；命中缓存时音频没有下载
+		complete_stage('download',{
+			'audio_file': audio_file if os.path.exists(audio_file) else None,
+			'preview_file': preview.result() if preview else None,
+			'source_id': audio_stream.source_id,
+		})
+
+	def translate():
+		if not target_language:
+			return {'translated_srt': ''}
+		report(message="Translating...")
+		return {'translated_srt': wrap_translate(merged['srt_file'],target_language,user=job['user'],priority=priority)}
+
+	translated = run_stage('translate',translate)
+
+	def upload():
+		return {
+			'srt_file_url': upload_file_to_supabase_storage(merged['srt_file']),
+			'txt_file_url': upload_file_to_supabase_storage(merged['txt_file']),
+			'translated_srt_url': upload_file_to_supabase_storage(translated['translated_srt']) if translated['translated_srt'] else '',
+		}
+
+	uploaded = run_stage('upload',upload)
+	return {
+		'youtube_video': stages.get('download',{}).get('preview_file') or '',
+		'audio_length': audio_length,
+		**merged,
+		**translated,
+		**uploaded,
+	}
@@ -0,0 +1,329 @@
+import re
+import math
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import contextlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_reset_duration(value):
+	# Groq 的重置时间格式形如 "2m59.56s"、"7.66s"、"120ms"，也可能是纯数字秒数
+	if value is None:
+		return None
+	value = str(value).strip()
+	try:
+		return float(value)
+	except ValueError:
+		pass
+	units = {'h':3600,'m':60,'s':1,'ms':0.001}
+	parts = re.findall(r'([\d.]+)(ms|h|m|s)',value)
+	if not parts:
+		return None
+	return sum(float(number) * units[unit] for number,unit in parts)
+
+
+class TokenBucket:
+	"""Classic token bucket: `capacity` tokens, refilled evenly over `period` seconds."""
+
+	def __init__(self,capacity,period):
+		self.capacity = float(capacity)
+		self.rate = self.capacity / period
+		self.tokens = self.capacity
+		# 使用系统时间而不是 monotonic，桶的状态才能在进程之间共享
+		self.updated = time.time()
+
+	def refill(self,now):
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def wait_time(self,amount,now):
+		# 单次请求超过桶容量时按满桶计算，否则永远等不到
+		amount = min(amount,self.capacity)
+		self.refill(now)
+		if self.tokens >= amount:
+			return 0.0
+		return (amount - self.tokens) / self.rate
+
+	def take(self,amount):
+		self.tokens -= min(amount,self.capacity)
+
+
+RATE_LIMIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+	name TEXT PRIMARY KEY,
+	requests REAL NOT NULL,
+	audio REAL NOT NULL,
+	updated REAL NOT NULL,
+	blocked_until REAL NOT NULL
+);
+"""
+
+
+class RateLimitStore:
+	"""Rate limiter state kept in a SQLite table, so every worker process draws on the same budget.
+
+	A transaction loads the rows of the given limiters into them, lets the
+	caller update their buckets and writes them back. Calls block on SQLite,
+	so async code runs them in a thread (see ApiKeyPool.acquire_async).
+	"""
+
+	def __init__(self,path):
+		self.path = path
+		self.local = threading.local()
+		with self._connect() as conn:
+			conn.executescript(RATE_LIMIT_SCHEMA)
+
+	def _connect(self):
+		# 每个线程复用自己的连接
+		conn = getattr(self.local,'conn',None)
+		if conn is None:
+			conn = self.local.conn = sqlite3.connect(self.path,timeout=30,isolation_level=None)
+		return contextlib.nullcontext(conn)
+
+	@contextlib.contextmanager
+	def transaction(self,limiters):
+		by_name = {limiter.name: limiter for limiter in limiters}
+		with self._connect() as conn:
+			conn.execute('BEGIN IMMEDIATE')
+			try:
+				rows = conn.execute(
+					f"SELECT name,requests,audio,updated,blocked_until FROM rate_limits WHERE name IN ({','.join('?' * len(by_name))})",
+					list(by_name),
+				).fetchall()
+				for name,requests,audio,updated,blocked_until in rows:
+					limiter = by_name[name]
+					limiter.requests.tokens,limiter.audio.tokens,limiter.blocked_until = requests,audio,blocked_until
+					limiter.requests.updated = limiter.audio.updated = updated
+				yield
+				conn.executemany(
+					'INSERT OR REPLACE INTO rate_limits (name,requests,audio,updated,blocked_until) VALUES (?,?,?,?,?)',
+					[(name,limiter.requests.tokens,limiter.audio.tokens,limiter.requests.updated,limiter.blocked_until) for name,limiter in by_name.items()],
+				)
+			except BaseException:
+				conn.execute('ROLLBACK')
+				raise
+			conn.execute('COMMIT')
+
+
+class RateLimiter:
+	"""Shared limiter gating request starts on requests-per-minute and audio-seconds-per-hour.
+
+	Budget is taken with `reserve()`, or through ApiKeyPool.try_acquire() for
+	pooled keys, right before sending a request. `update_from_headers()` feeds
+	Groq's `x-ratelimit-*` / `retry-after` headers back so the local budget never
+	runs ahead of what the server reports. With a RateLimitStore the budget is
+	shared by every process using the same store and `name`; otherwise it is
+	per process.
+	"""
+
+	def __init__(self,requests_per_minute,audio_seconds_per_hour,store=None,name='',lock=None):
+		self.lock = lock or threading.RLock()
+		self.requests = TokenBucket(requests_per_minute,60)
+		self.audio = TokenBucket(audio_seconds_per_hour,3600)
+		self.blocked_until = 0.0
+		self.store = store
+		self.name = name
+
+	@contextlib.contextmanager
+	def _locked(self):
+		with self.lock:
+			if self.store is None:
+				yield
+			else:
+				with self.store.transaction([self]):
+					yield
+
+	def _wait(self,audio_seconds,now):
+		return max(
+			self.blocked_until - now,
+			self.requests.wait_time(1,now),
+			self.audio.wait_time(audio_seconds,now),
+		)
+
+	def _take(self,audio_seconds):
+		self.requests.take(1)
+		self.audio.take(audio_seconds)
+
+	def wait_time(self,audio_seconds=0):
+		"""Seconds until a request of this size could start, without taking any budget.
+
+		Only reads the in-memory state; with a store it is as of this process's
+		last transaction, which is enough for an estimate.
+		"""
+		with self.lock:
+			return max(self._wait(audio_seconds,time.time()),0.0)
+
+	def reserve(self,audio_seconds=0):
+		"""Take budget for one request if available; otherwise return the seconds to wait."""
+		with self._locked():
+			wait = self._wait(audio_seconds,time.time())
+			if wait <= 0:
+				self._take(audio_seconds)
+				return 0.0
+			return wait
+
+	def block_for(self,seconds):
+		with self._locked():
+			self._block(seconds)
+
+	def _block(self,seconds):
+		self.blocked_until = max(self.blocked_until, time.time() + seconds)
+		logger.warning(f"rate limit reached, pausing new requests for {seconds:.1f}s")
+
+	def update_from_headers(self,headers):
+		if not headers:
+			return
+		retry_after = parse_reset_duration(headers.get('retry-after'))
+		remaining = headers.get('x-ratelimit-remaining-requests')
+		if not retry_after and remaining is None:
+			return
+		# 所有更新在同一个事务中完成
+		with self._locked():
+			if retry_after:
+				self._block(retry_after)
+			if remaining is None:
+				return
+			remaining = float(remaining)
+			# 服务端剩余额度比本地估计少时，以服务端为准
+			self.requests.tokens = min(self.requests.tokens, remaining)
+			if remaining <= 0:
+				reset = parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+				if reset:
+					self._block(reset)
+
+
+# 默认的密钥剔除时长（秒）：429 未给出重置时间时，以及 401 鉴权失败时
+KEY_RATE_LIMIT_EJECT_SECONDS = 60
+KEY_AUTH_EJECT_SECONDS = 3600
+
+
+class ApiKeysUnauthorizedError(Exception):
+	pass
+
+
+class ApiKey:
+	"""One API key with its own RateLimiter and ejection state."""
+
+	def __init__(self,key,requests_per_minute,audio_seconds_per_hour,store=None,lock=None):
+		self.key = key
+		# 共享存储中只记录密钥的哈希
+		self.limiter = RateLimiter(requests_per_minute,audio_seconds_per_hour,store,f'key:{hashlib.sha256(key.encode()).hexdigest()[:16]}',lock)
+		self.ejected_until = 0.0
+		# 因鉴权失败被剔除的截止时间，此前不会被选用
+		self.unauthorized_until = 0.0
+		self.in_flight = 0
+
+	def __repr__(self):
+		# 日志中只显示密钥末尾几位
+		return f'ApiKey(...{self.key[-4:]})'
+
+
+class ApiKeyPool:
+	"""Pool of API keys with per-key rate accounting and least-loaded selection.
+
+	A key that gets a 429 or 401 is ejected until its reset window has passed
+	and then re-admitted automatically. Throughput grows with the number of keys.
+	With a RateLimitStore, every process sharing it spends one budget per key;
+	picking a key and taking its budget is a single store transaction, run in
+	a thread so the event loop never waits on SQLite.
+	When every key is rate limited, requests wait for the first one to recover;
+	when every key has failed authentication, they fail at once with
+	ApiKeysUnauthorizedError instead of waiting out the ejection.
+	"""
+
+	def __init__(self,keys,requests_per_minute,audio_seconds_per_hour,store=None):
+		if not keys:
+			raise ValueError("ApiKeyPool needs at least one key")
+		self.store = store
+		# 所有密钥的限流器共用池的锁，选择密钥和占用额度是一个原子操作
+		self.lock = threading.RLock()
+		self.keys = [ApiKey(key,requests_per_minute,audio_seconds_per_hour,store,self.lock) for key in keys]
+
+	def _authorized(self,now):
+		return [key for key in self.keys if key.unauthorized_until <= now]
+
+	def _admitted(self,now):
+		authorized = self._authorized(now)
+		if not authorized:
+			raise ApiKeysUnauthorizedError(f"all {len(self.keys)} API key(s) failed authentication")
+		admitted = [key for key in authorized if key.ejected_until <= now]
+		# 全部因限流被剔除时，退而使用最早恢复的密钥
+		return admitted or [min(authorized,key=lambda key: key.ejected_until)]
+
+	def _key_wait(self,key,audio_seconds,now):
+		return max(key.ejected_until - now, key.limiter._wait(audio_seconds,time.time()))
+
+	def try_acquire(self,audio_seconds=0):
+		"""Take budget on the best key if one is ready; returns (key, 0) or (None, seconds to wait)."""
+		with self.lock:
+			now = time.monotonic()
+			keys = self._admitted(now)
+			with self.store.transaction([key.limiter for key in keys]) if self.store else contextlib.nullcontext():
+				# 选择最早可以发出请求、且在途请求最少的密钥
+				key = min(keys,key=lambda key: (self._key_wait(key,audio_seconds,now),key.in_flight))
+				wait = self._key_wait(key,audio_seconds,now)
+				if wait > 0:
+					return None,wait
+				key.limiter._take(audio_seconds)
+				key.in_flight += 1
+				return key,0.0
+
+	def wait_time(self,audio_seconds=0):
+		# 只读取内存中的状态，不访问共享存储
+		with self.lock:
+			now = time.monotonic()
+			return max(min((self._key_wait(key,audio_seconds,now) for key in self._authorized(now)),default=math.inf),0.0)
+
+	def has_other_key(self,key):
+		now = time.monotonic()
+		return any(other is not key and other.ejected_until <= now for other in self.keys)
+
+	async def acquire_async(self,audio_seconds=0):
+		"""Reserve budget on the best key and return it; the caller must call release() when done."""
+		while True:
+			if self.store is None:
+				key,wait = self.try_acquire(audio_seconds)
+			else:
+				key,wait = await asyncio.to_thread(self.try_acquire,audio_seconds)
+			if key is not None:
+				return key
+			# 等待期间其他密钥可能先恢复，因此最多等待 1 秒后重新选择
+			await asyncio.sleep(min(wait,1.0))
+
+	async def update_from_headers_async(self,key,headers):
+		# 写共享存储的操作放到线程中，不阻塞事件循环
+		if self.store is None:
+			key.limiter.update_from_headers(headers)
+		else:
+			await asyncio.to_thread(key.limiter.update_from_headers,headers)
+
+	async def report_error_async(self,key,status_code,headers):
+		if self.store is None:
+			self.report_error(key,status_code,headers)
+		else:
+			await asyncio.to_thread(self.report_error,key,status_code,headers)
+
+	def release(self,key):
+		with self.lock:
+			key.in_flight -= 1
+
+	def eject(self,key,seconds,unauthorized=False):
+		with self.lock:
+			key.ejected_until = max(key.ejected_until, time.monotonic() + seconds)
+			if unauthorized:
+				key.unauthorized_until = key.ejected_until
+		logger.warning(f"{key} ejected from the pool for {seconds:.0f}s")
+
+	def report_error(self,key,status_code,headers):
+		key.limiter.update_from_headers(headers)
+		if status_code == 429:
+			reset = parse_reset_duration(headers.get('retry-after')) or parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+			self.eject(key,reset or KEY_RATE_LIMIT_EJECT_SECONDS)
+		elif status_code == 401:
+			self.eject(key,KEY_AUTH_EJECT_SECONDS,unauthorized=True)
@@ -0,0 +1,114 @@
+import heapq
+import asyncio
+import itertools
+import functools
+import threading
+import collections
+import concurrent.futures
+import streamlit as st
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 各类任务在整个进程内的并发上限：transcribe 为转录分片，translate 为翻译分段。
+# 每个 worker 进程各自使用这一上限；请求速率由各进程共享的限流额度控制（见 RateLimitStore）
+DEFAULT_CAPACITIES = {
+	'transcribe': 32,
+	'translate': 10,
+}
+
+
+class FairScheduler:
+	"""Process-wide scheduler that every session submits chunk work to.
+
+	Work is grouped into pools with a fixed concurrency each. When a slot frees
+	up, the user with the fewest running items in that pool goes next (fair
+	share), and within that user the item with the lowest priority value wins,
+	e.g. the shortest file first. Work runs as coroutines on the shared event
+	loop; submit() can be called from any thread. Cancelling the returned
+	future drops queued work and cancels the task of work already running.
+	"""
+
+	def __init__(self,loop,capacities=DEFAULT_CAPACITIES):
+		self.loop = loop
+		self.capacities = dict(capacities)
+		self.running = collections.defaultdict(int)
+		self.user_running = collections.defaultdict(int)
+		self.queues = collections.defaultdict(dict)
+		self.seq = itertools.count()
+
+	def submit(self,coro_factory,user='anonymous',priority=0,pool='transcribe'):
+		"""Queue coro_factory() to run in `pool`; returns a concurrent.futures.Future with its result."""
+		future = concurrent.futures.Future()
+		item = (priority,next(self.seq),coro_factory,future)
+		self.loop.call_soon_threadsafe(self._enqueue,pool,user,item)
+		return future
+
+	def _enqueue(self,pool,user,item):
+		heapq.heappush(self.queues[pool].setdefault(user,[]),item)
+		self._dispatch(pool)
+
+	def _dispatch(self,pool):
+		queues = self.queues[pool]
+		while queues and self.running[pool] < self.capacities.get(pool,1):
+			# 在途任务最少的用户优先；相同时比较各自队首任务的优先级和提交顺序
+			user = min(queues,key=lambda u: (self.user_running[(pool,u)],queues[u][0][:2]))
+			_,_,coro_factory,future = heapq.heappop(queues[user])
+			if not queues[user]:
+				del queues[user]
+			# 已被调用方取消的任务直接丢弃
+			if future.cancelled():
+				continue
+			self.running[pool] += 1
+			self.user_running[(pool,user)] += 1
+			task = self.loop.create_task(coro_factory())
+			task.add_done_callback(functools.partial(self._finished,pool,user,future))
+			# future 保持 PENDING 状态，调用方随时可以取消，取消时一并取消正在运行的协程
+			future.add_done_callback(functools.partial(self._cancel_task,task))
+
+	def _cancel_task(self,task,future):
+		if future.cancelled():
+			self.loop.call_soon_threadsafe(task.cancel)
+
+	def _finished(self,pool,user,future,task):
+		self.running[pool] -= 1
+		self.user_running[(pool,user)] -= 1
+		if not self.user_running[(pool,user)]:
+			del self.user_running[(pool,user)]
+		try:
+			if task.cancelled():
+				future.cancel()
+			elif task.exception() is not None:
+				future.set_exception(task.exception())
+			else:
+				future.set_result(task.result())
+		except concurrent.futures.InvalidStateError:
+			# 调用方已经取消
+			pass
+		self._dispatch(pool)
+
+
+# 进程内共享的事件循环（在独立线程中运行）和调度器
+_loop = None
+_scheduler = None
+_lock = threading.Lock()
+
+def get_loop():
+	global _loop
+	with _lock:
+		if _loop is None:
+			_loop = asyncio.new_event_loop()
+			threading.Thread(target=_loop.run_forever,name='transcription-loop',daemon=True).start()
+		return _loop
+
+def get_scheduler():
+	global _scheduler
+	loop = get_loop()
+	with _lock:
+		if _scheduler is None:
+			_scheduler = FairScheduler(loop,{
+				pool: int(st.secrets.get(f'max_concurrent_{pool}',capacity))
+				for pool,capacity in DEFAULT_CAPACITIES.items()
+			})
+		return _scheduler
@@ -93,35 +93,40 @@ def split_text_by_token_length(text: str, delimiter: str, chunk_token: int, mode
 
 
 
+import asyncio
 import concurrent.futures
+from scheduler import get_scheduler
 
-# 高并发处理翻译
-def process_subtitle_chunks(subtitle_chunks, system_prompt, model):
+# 高并发处理翻译，并发由进程内全局调度器的 translate 池控制
+def process_subtitle_chunks(subtitle_chunks, system_prompt, model, user='anonymous', priority=0):
     results = [None] * len(subtitle_chunks)  # 预先分配一个与 subtitle_chunks 等长的列表
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {
-            executor.submit(get_completion, chunk, system_prompt, model): idx
-            for idx, chunk in enumerate(subtitle_chunks)
-        }
-        for future in concurrent.futures.as_completed(futures):
-            idx = futures[future]  # 获取任务的索引
-            try:
-                result = future.result()
-                results[idx] = result  # 将结果放在预先分配的列表的正确位置
-                print(f"Completed task {idx+1}/{len(subtitle_chunks)}")  # 打印当前任务的进度
-            except Exception as e:
-                print(f"Error in task {idx+1}: {e}")
+    scheduler = get_scheduler()
+    futures = {
+        scheduler.submit(
+            lambda chunk=chunk: asyncio.to_thread(get_completion, chunk, system_prompt, model),
+            user=user, priority=priority, pool='translate'
+        ): idx
+        for idx, chunk in enumerate(subtitle_chunks)
+    }
+    for future in concurrent.futures.as_completed(futures):
+        idx = futures[future]  # 获取任务的索引
+        try:
+            result = future.result()
+            results[idx] = result  # 将结果放在预先分配的列表的正确位置
+            print(f"Completed task {idx+1}/{len(subtitle_chunks)}")  # 打印当前任务的进度
+        except Exception as e:
+            print(f"Error in task {idx+1}: {e}")
     return results
 
 
-def wrap_translate(srt_file,language,system_prompt=system_prompt):
+def wrap_translate(srt_file,language,system_prompt=system_prompt,user='anonymous',priority=0):
 
     with open(srt_file) as f:
         subtitle_en = f.read()
 
     # split text
     subtitle_en_splits = split_text_by_token_length(subtitle_en.strip(),delimiter='\n\n',chunk_token=1000,model=st.secrets['chat_model'])
-    subtitle_multi_splits = process_subtitle_chunks(subtitle_en_splits, system_prompt.format(language=language), model=st.secrets['chat_model'])
+    subtitle_multi_splits = process_subtitle_chunks(subtitle_en_splits, system_prompt.format(language=language), model=st.secrets['chat_model'], user=user, priority=priority)
 
 
     multilingo_subtitle = '\n\n'.join(subtitle_multi_splits)
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+	return JobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+
+# ---------- 重复任务 ----------
+
+def test_duplicate_job_attaches_to_running_job(queue):
+	leader = queue.enqueue('transcribe',{'url': 'a'},user='u1',dedup_key='k')
+	follower = queue.enqueue('transcribe',{'url': 'a'},user='u2',dedup_key='k')
+	assert queue.claim('w1')['id'] == leader
+	# 挂起的任务不会被领取，但显示所挂任务的状态
+	assert queue.claim('w2') is None
+	queue.report(leader,progress=0.5,message='halfway')
+	job = queue.get(follower)
+	assert (job['status'],job['progress'],job['message']) == ('running',0.5,'halfway')
+	assert queue.active_for_user('u2')['id'] == follower
+
+def test_finish_completes_attached_jobs(queue):
+	leader = queue.enqueue('transcribe',{},dedup_key='k')
+	follower = queue.enqueue('transcribe',{},dedup_key='k')
+	queue.claim('w1')
+	queue.finish(leader,{'txt': 'hello'})
+	for job_id in (leader,follower):
+		job = queue.get(job_id)
+		assert (job['status'],job['result']) == ('done',{'txt': 'hello'})
+
+def test_fail_fails_attached_jobs(queue):
+	leader = queue.enqueue('transcribe',{},dedup_key='k')
+	follower = queue.enqueue('transcribe',{},dedup_key='k')
+	queue.claim('w1')
+	queue.fail(leader,'boom')
+	job = queue.get(follower)
+	assert (job['status'],job['error']) == ('error','boom')
+
+def test_finished_job_is_not_reused(queue):
+	first = queue.enqueue('transcribe',{},dedup_key='k')
+	queue.claim('w1')
+	queue.finish(first,{})
+	second = queue.enqueue('transcribe',{},dedup_key='k')
+	assert queue.get(second)['status'] == 'queued'
+	assert queue.claim('w1')['id'] == second
+
+
+# ---------- 失去心跳的任务 ----------
+
+def test_stale_job_is_requeued(tmp_path):
+	queue = JobQueue(str(tmp_path / 'jobs.sqlite3'),stale_seconds=0.05,max_attempts=2)
+	job_id = queue.enqueue('transcribe',{})
+	assert queue.claim('w1')['id'] == job_id
+	time.sleep(0.1)
+	assert queue.claim('w2')['id'] == job_id
+	job = queue.get(job_id)
+	assert (job['status'],job['worker'],job['attempts']) == ('running','w2',2)
+
+def test_stale_job_fails_after_max_attempts(tmp_path):
+	queue = JobQueue(str(tmp_path / 'jobs.sqlite3'),stale_seconds=0.05,max_attempts=1)
+	job_id = queue.enqueue('transcribe',{})
+	queue.claim('w1')
+	time.sleep(0.1)
+	assert queue.claim('w2') is None
+	job = queue.get(job_id)
+	assert (job['status'],job['error']) == ('error','worker stopped responding')
+
+def test_heartbeat_keeps_job_running(tmp_path):
+	queue = JobQueue(str(tmp_path / 'jobs.sqlite3'),stale_seconds=0.2)
+	job_id = queue.enqueue('transcribe',{})
+	queue.claim('w1')
+	time.sleep(0.15)
+	queue.heartbeat(job_id)
+	time.sleep(0.1)
+	assert queue.claim('w2') is None
+	assert queue.get(job_id)['worker'] == 'w1'
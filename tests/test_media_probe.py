@@ -0,0 +1,157 @@
+import io
+import struct
+
+import pytest
+
+import media_probe
+from media_probe import parse_wav, parse_mp3, parse_mp4, parse_webm, probe_headers, probe_media, MediaProbeError
+
+
+def parse(parser,data):
+	return parser(io.BytesIO(data),len(data))
+
+
+# ---------- WAV ----------
+
+def wav_bytes(seconds=2,sample_rate=16000,channels=1,data_size=None):
+	data = b'\0' * (seconds * sample_rate * channels * 2)
+	fmt = struct.pack('<HHIIHH',1,channels,sample_rate,sample_rate * channels * 2,channels * 2,16)
+	return (
+		b'RIFF' + struct.pack('<I',36 + len(data)) + b'WAVE'
+		+ b'LIST' + struct.pack('<I',3) + b'abc\0'  # 奇数长度的块带一个填充字节
+		+ b'fmt ' + struct.pack('<I',len(fmt)) + fmt
+		+ b'data' + struct.pack('<I',len(data) if data_size is None else data_size) + data
+	)
+
+def test_wav():
+	info = parse(parse_wav,wav_bytes(seconds=2,sample_rate=16000,channels=2))
+	assert info['duration'] == pytest.approx(2.0)
+	assert (info['codec'],info['sample_rate'],info['channels'],info['format']) == ('pcm_s16le',16000,2,'wav')
+
+def test_wav_streamed_data_size():
+	# data 长度未知时按文件剩余长度计算
+	info = parse(parse_wav,wav_bytes(seconds=3,data_size=0xFFFFFFFF))
+	assert info['duration'] == pytest.approx(3.0)
+
+
+# ---------- MP3 ----------
+
+def mp3_frame_header(bitrate_index=9,rate_index=0,mono=False):
+	# MPEG-1 Layer III，bitrate_index 9 为 128 kbps，rate_index 0 为 44100 Hz
+	return bytes([0xFF,0xFB,(bitrate_index << 4) | (rate_index << 2),0xC0 if mono else 0x00])
+
+def id3_tag(body_size):
+	size = bytes([(body_size >> 21) & 0x7F,(body_size >> 14) & 0x7F,(body_size >> 7) & 0x7F,body_size & 0x7F])
+	return b'ID3\x03\x00\x00' + size + b'\0' * body_size
+
+def test_mp3_cbr():
+	audio = mp3_frame_header() + b'\0' * (128000 // 8 * 5 - 4)
+	info = parse(parse_mp3,id3_tag(300) + audio)
+	assert info['duration'] == pytest.approx(5.0)
+	assert (info['codec'],info['sample_rate'],info['channels']) == ('mp3',44100,2)
+
+def test_mp3_xing():
+	# 立体声 MPEG-1 的 side info 为 32 字节，Xing 头紧随其后
+	frame = mp3_frame_header() + b'\0' * 32 + b'Xing' + struct.pack('>II',1,1000)
+	info = parse(parse_mp3,frame + b'\0' * 400)
+	assert info['duration'] == pytest.approx(1000 * 1152 / 44100)
+
+def test_mp3_vbri():
+	frame = mp3_frame_header(mono=True) + b'\0' * 32 + b'VBRI' + b'\0' * 10 + struct.pack('>I',500)
+	info = parse(parse_mp3,frame + b'\0' * 400)
+	assert info['duration'] == pytest.approx(500 * 1152 / 44100)
+	assert info['channels'] == 1
+
+
+# ---------- MP4 ----------
+
+def box(box_type,body):
+	return struct.pack('>I',8 + len(body)) + box_type + body
+
+def full_box(box_type,version,body):
+	return box(box_type,bytes([version,0,0,0]) + body)
+
+def m4a_bytes(timescale=1000,duration=90500,mvhd_version=0,mehd=None):
+	if mvhd_version == 1:
+		mvhd = full_box(b'mvhd',1,struct.pack('>QQIQ',0,0,timescale,duration) + b'\0' * 80)
+	else:
+		mvhd = full_box(b'mvhd',0,struct.pack('>IIII',0,0,timescale,duration) + b'\0' * 80)
+	hdlr = full_box(b'hdlr',0,b'\0' * 4 + b'soun' + b'\0' * 12)
+	mp4a = box(b'mp4a',b'\0' * 6 + struct.pack('>H',1) + b'\0' * 8 + struct.pack('>HHHHI',2,16,0,0,44100 << 16))
+	stsd = full_box(b'stsd',0,struct.pack('>I',1) + mp4a)
+	trak = box(b'trak',box(b'mdia',hdlr + box(b'minf',box(b'stbl',stsd))))
+	mvex = box(b'mvex',full_box(b'mehd',0,struct.pack('>I',mehd))) if mehd is not None else b''
+	return box(b'ftyp',b'M4A \0\0\0\0') + box(b'moov',mvhd + trak + mvex) + box(b'mdat',b'\0' * 100)
+
+def test_mp4():
+	info = parse(parse_mp4,m4a_bytes())
+	assert info['duration'] == pytest.approx(90.5)
+	assert (info['codec'],info['sample_rate'],info['channels'],info['format']) == ('aac',44100,2,'mp4')
+
+def test_mp4_version_1_mvhd():
+	info = parse(parse_mp4,m4a_bytes(timescale=48000,duration=48000 * 7200,mvhd_version=1))
+	assert info['duration'] == pytest.approx(7200)
+
+def test_fragmented_mp4_duration_from_mehd():
+	info = parse(parse_mp4,m4a_bytes(timescale=1000,duration=0,mehd=12345))
+	assert info['duration'] == pytest.approx(12.345)
+
+
+# ---------- WebM ----------
+
+def ebml_element(element_id,body):
+	# 长度统一用 8 字节的变长整数编码
+	return element_id + bytes([0x01]) + len(body).to_bytes(7,'big') + body
+
+def webm_bytes(duration_ms=61500.0,unknown_segment_size=False):
+	info = ebml_element(b'\x2A\xD7\xB1',(1000000).to_bytes(3,'big')) + ebml_element(b'\x44\x89',struct.pack('>d',duration_ms))
+	audio = ebml_element(b'\xB5',struct.pack('>f',48000.0)) + ebml_element(b'\x9F',b'\x02')
+	track = ebml_element(b'\x83',b'\x02') + ebml_element(b'\x86',b'A_OPUS') + ebml_element(b'\xE1',audio)
+	body = ebml_element(b'\x15\x49\xA9\x66',info) + ebml_element(b'\x16\x54\xAE\x6B',ebml_element(b'\xAE',track))
+	cluster = ebml_element(b'\x1F\x43\xB6\x75',b'\0' * 64)
+	header = ebml_element(b'\x1A\x45\xDF\xA3',ebml_element(b'\x42\x82',b'webm'))
+	if unknown_segment_size:
+		return header + b'\x18\x53\x80\x67' + b'\x01\xFF\xFF\xFF\xFF\xFF\xFF\xFF' + body + cluster
+	return header + ebml_element(b'\x18\x53\x80\x67',body + cluster)
+
+def test_webm():
+	info = parse(parse_webm,webm_bytes())
+	assert info['duration'] == pytest.approx(61.5)
+	assert (info['codec'],info['sample_rate'],info['channels'],info['format']) == ('opus',48000,2,'webm')
+
+def test_webm_unknown_segment_size():
+	# 直播录制等流式写出的文件，Segment 长度为“未知”
+	info = parse(parse_webm,webm_bytes(unknown_segment_size=True))
+	assert info['duration'] == pytest.approx(61.5)
+	assert info['codec'] == 'opus'
+
+
+# ---------- 截断和无法识别的文件 ----------
+
+@pytest.mark.parametrize('data',[wav_bytes()[:30],m4a_bytes()[:44],webm_bytes()[:50]])
+def test_truncated_headers_do_not_raise(tmp_path,data):
+	path = tmp_path / 'truncated'
+	path.write_bytes(data)
+	info = probe_headers(str(path))
+	assert info is None or info['duration'] is None
+
+@pytest.mark.parametrize('data',[b'',b'\0' * 1000,b'not a media file at all' * 100,b'RIFF\0\0\0\0AVI '])
+def test_garbage_is_not_recognised(tmp_path,data):
+	path = tmp_path / 'garbage'
+	path.write_bytes(data)
+	assert probe_headers(str(path)) is None
+	with pytest.raises(MediaProbeError):
+		probe_media(str(path))
+
+def test_probe_media_caches_by_content(tmp_path,monkeypatch):
+	# 不使用 ffprobe，只测试文件头解析和缓存
+	monkeypatch.setattr(media_probe.shutil,'which',lambda name: None)
+	path = tmp_path / 'a.wav'
+	path.write_bytes(wav_bytes(seconds=4))
+	assert probe_media(str(path))['duration'] == pytest.approx(4.0)
+	calls = []
+	monkeypatch.setattr(media_probe,'probe_headers',lambda p: calls.append(p))
+	copy = tmp_path / 'b.wav'
+	copy.write_bytes(wav_bytes(seconds=4))
+	assert probe_media(str(copy))['duration'] == pytest.approx(4.0)
+	assert calls == []
@@ -0,0 +1,85 @@
+import time
+import asyncio
+
+import pytest
+
+from rate_limiter import ApiKeyPool, ApiKeysUnauthorizedError, RateLimitStore, RateLimiter
+
+
+def make_pool(keys=('key-a','key-b'),rpm=100,aph=3600,store=None):
+	return ApiKeyPool(list(keys),rpm,aph,store)
+
+
+# ---------- 剔除与恢复 ----------
+
+def test_rate_limited_key_is_ejected_and_readmitted():
+	pool = make_pool()
+	first,second = pool.keys
+	pool.report_error(first,429,{'retry-after': '0.1'})
+	key,wait = pool.try_acquire()
+	assert key is second and wait == 0
+	pool.release(key)
+	time.sleep(0.15)
+	# 剔除时间过后重新参与选择，在途请求更少的密钥优先
+	key,_ = pool.try_acquire()
+	busy,_ = pool.try_acquire()
+	assert {key,busy} == {first,second}
+
+def test_all_keys_rate_limited_waits_for_first_recovery():
+	pool = make_pool(keys=('key-a',))
+	pool.report_error(pool.keys[0],429,{'retry-after': '0.2'})
+	key,wait = pool.try_acquire()
+	assert key is None and 0 < wait <= 0.2
+	started = time.monotonic()
+	key = asyncio.run(pool.acquire_async())
+	assert key is pool.keys[0]
+	assert time.monotonic() - started >= 0.1
+
+
+# ---------- 401 ----------
+
+def test_unauthorized_key_is_skipped():
+	pool = make_pool()
+	first,second = pool.keys
+	pool.report_error(first,401,{})
+	for _ in range(3):
+		key,_ = pool.try_acquire()
+		assert key is second
+
+def test_all_keys_unauthorized_fails_fast():
+	pool = make_pool()
+	for key in pool.keys:
+		pool.report_error(key,401,{})
+	started = time.monotonic()
+	with pytest.raises(ApiKeysUnauthorizedError):
+		asyncio.run(pool.acquire_async())
+	assert time.monotonic() - started < 1
+
+
+# ---------- 通过 RateLimitStore 共享额度 ----------
+
+def test_budget_is_shared_through_store(tmp_path):
+	path = str(tmp_path / 'jobs.sqlite3')
+	# 两个存储对象模拟两个 worker 进程
+	pools = [make_pool(keys=('key-a',),rpm=3,store=RateLimitStore(path)) for _ in range(2)]
+	granted = 0
+	for pool in pools * 2:
+		key,wait = pool.try_acquire()
+		granted += key is not None
+	assert granted == 3
+	key,wait = pools[0].try_acquire()
+	assert key is None and wait > 0
+
+def test_headers_are_shared_through_store(tmp_path):
+	path = str(tmp_path / 'jobs.sqlite3')
+	first = RateLimiter(100,3600,RateLimitStore(path),'key:x')
+	second = RateLimiter(100,3600,RateLimitStore(path),'key:x')
+	first.update_from_headers({'x-ratelimit-remaining-requests': '0','x-ratelimit-reset-requests': '30s'})
+	assert second.reserve() > 20
+
+def test_wait_time_takes_no_budget():
+	limiter = RateLimiter(1,3600)
+	assert limiter.wait_time() == 0
+	assert limiter.wait_time() == 0
+	assert limiter.reserve() == 0
+	assert limiter.wait_time() > 0
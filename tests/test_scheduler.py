@@ -0,0 +1,105 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+import pytest
+
+from scheduler import FairScheduler
+
+
+@pytest.fixture
+def loop():
+	loop = asyncio.new_event_loop()
+	thread = threading.Thread(target=loop.run_forever,daemon=True)
+	thread.start()
+	yield loop
+	loop.call_soon_threadsafe(loop.stop)
+	thread.join()
+	loop.close()
+
+
+class Recorder:
+	"""Jobs that record their start order and block until their gate is opened."""
+
+	def __init__(self):
+		self.started = []
+		self.gates = {}
+
+	def job(self,name):
+		gate = self.gates[name] = threading.Event()
+		async def run():
+			self.started.append(name)
+			while not gate.is_set():
+				await asyncio.sleep(0.005)
+			return name
+		return run
+
+	def wait_started(self,count,timeout=2):
+		deadline = time.monotonic() + timeout
+		while len(self.started) < count and time.monotonic() < deadline:
+			time.sleep(0.005)
+		return list(self.started)
+
+	def open_all(self):
+		for gate in self.gates.values():
+			gate.set()
+
+
+def test_user_with_fewest_running_goes_next(loop):
+	scheduler = FairScheduler(loop,{'transcribe': 2})
+	recorder = Recorder()
+	futures = [scheduler.submit(recorder.job(name),user='a') for name in ('a1','a2','a3')]
+	assert recorder.wait_started(2) == ['a1','a2']
+	futures.append(scheduler.submit(recorder.job('b1'),user='b'))
+	recorder.gates['a1'].set()
+	# a 仍有一个任务在运行，b 没有，所以 b1 先于 a3
+	assert recorder.wait_started(3)[2] == 'b1'
+	recorder.open_all()
+	assert [future.result(timeout=2) for future in futures] == ['a1','a2','a3','b1']
+
+def test_lower_priority_value_runs_first(loop):
+	scheduler = FairScheduler(loop,{'transcribe': 1})
+	recorder = Recorder()
+	futures = [scheduler.submit(recorder.job('gate'))]
+	recorder.wait_started(1)
+	futures += [scheduler.submit(recorder.job(f'p{priority}'),priority=priority) for priority in (5,1,3)]
+	recorder.open_all()
+	concurrent.futures.wait(futures,timeout=2)
+	assert recorder.started == ['gate','p1','p3','p5']
+
+def test_pools_have_separate_capacity(loop):
+	scheduler = FairScheduler(loop,{'transcribe': 1,'translate': 1})
+	recorder = Recorder()
+	futures = [scheduler.submit(recorder.job(name),pool=pool) for name,pool in (('t1','transcribe'),('t2','transcribe'),('x1','translate'))]
+	assert sorted(recorder.wait_started(2)) == ['t1','x1']
+	recorder.open_all()
+	concurrent.futures.wait(futures,timeout=2)
+
+
+# ---------- 取消 ----------
+
+def test_cancelled_queued_work_never_runs(loop):
+	scheduler = FairScheduler(loop,{'transcribe': 1})
+	recorder = Recorder()
+	gate = scheduler.submit(recorder.job('gate'))
+	recorder.wait_started(1)
+	dropped = scheduler.submit(recorder.job('dropped'))
+	kept = scheduler.submit(recorder.job('kept'))
+	assert dropped.cancel()
+	recorder.open_all()
+	assert kept.result(timeout=2) == 'kept'
+	assert gate.result(timeout=2) == 'gate'
+	assert 'dropped' not in recorder.started
+
+def test_cancelling_running_work_frees_its_slot(loop):
+	scheduler = FairScheduler(loop,{'transcribe': 1})
+	recorder = Recorder()
+	running = scheduler.submit(recorder.job('running'))
+	recorder.wait_started(1)
+	queued = scheduler.submit(recorder.job('queued'))
+	assert running.cancel()
+	# 正在运行的协程被取消，空出的位置交给排队的任务
+	assert recorder.wait_started(2) == ['running','queued']
+	recorder.open_all()
+	assert queued.result(timeout=2) == 'queued'
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from groq_whisper import SilenceTrimmer, make_chunk, map_time, to_absolute, SAMPLE_RATE
+
+
+def speech(seconds,seed):
+	rng = np.random.default_rng(seed)
+	return (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 3000).astype(np.int16)
+
+def silence(seconds):
+	return np.zeros(int(seconds * SAMPLE_RATE),dtype=np.int16)
+
+def trim(samples,block_bytes):
+	# 按不对齐帧长的块大小喂入，模拟从 ffmpeg 管道读到的数据
+	trimmer = SilenceTrimmer()
+	data = samples.tobytes()
+	kept = b''.join(trimmer.feed(data[i:i+block_bytes]) for i in range(0,len(data),block_bytes))
+	kept += trimmer.finish()
+	return trimmer,np.frombuffer(kept,dtype=np.int16)
+
+ORIGINAL = np.concatenate([speech(5,1),silence(0.5),speech(3,2),silence(10),speech(4,3),silence(2.3),speech(1.01,4),silence(3)])
+
+
+@pytest.mark.parametrize('block_bytes',[1,333,12345,2 * SAMPLE_RATE * 10,len(ORIGINAL) * 2])
+def test_kept_samples_map_back_to_identical_original_samples(block_bytes):
+	trimmer,kept = trim(ORIGINAL,block_bytes)
+	# 10 秒和 2.3 秒的静音被截短，0.5 秒的停顿保留，末尾的静音去掉
+	assert len(kept) < len(ORIGINAL) - 11 * SAMPLE_RATE
+	assert len(trimmer.pieces) == 3
+	positions = np.arange(len(kept))
+	original = np.array([trimmer.original_sample(int(p)) for p in positions[::97]])
+	assert (kept[positions[::97]] == ORIGINAL[original]).all()
+	assert np.all(np.diff(original) > 0)
+
+def test_results_do_not_depend_on_block_size():
+	reference,kept = trim(ORIGINAL,len(ORIGINAL) * 2)
+	for block_bytes in (1,777,4096):
+		trimmer,other = trim(ORIGINAL,block_bytes)
+		assert trimmer.pieces == reference.pieces
+		assert (other == kept).all()
+
+def test_all_speech_is_left_untouched():
+	samples = speech(7.3,5)
+	trimmer,kept = trim(samples,999)
+	assert (kept == samples).all()
+	assert trimmer.pieces == [(0,0)]
+
+def test_time_map_gives_original_times():
+	trimmer,kept = trim(ORIGINAL,4096)
+	offset = SAMPLE_RATE * 6
+	chunk = make_chunk('audio.pcm',offset,kept[offset:],0,'flac',trimmer)
+	assert chunk['start'] == pytest.approx(6.0)
+	assert chunk['end'] == pytest.approx((trimmer.original_sample(len(kept) - 1) + 1) / SAMPLE_RATE)
+	for t in (0.0,1.3,2.9,3.5,6.0):
+		kept_sample = offset + int(t * SAMPLE_RATE)
+		assert map_time(chunk['time_map'],t) == pytest.approx(trimmer.original_sample(kept_sample) / SAMPLE_RATE,abs=1 / SAMPLE_RATE)
+
+def test_to_absolute_with_time_map_and_tempo():
+	# 变速 1.5 倍后的音频去除静音：分片内 0-2 秒对应原音频 10 秒起，2 秒之后跳到原音频 30 秒
+	chunk = {'start': 10.0,'end': 40.0,'tempo': 1.5,'time_map': [[0.0,10.0],[2.0,30.0]]}
+	segments = to_absolute([
+		{'start': 1.0,'end': 1.5,'text': 'a'},
+		{'start': 2.0,'end': 4.0,'text': 'b'},
+		{'start': 9.0,'end': 9.9,'text': 'c'},
+	],chunk)
+	assert [(s['start'],s['end']) for s in segments] == [
+		pytest.approx((11.5,12.25)),
+		pytest.approx((30.0,33.0)),
+		pytest.approx((40.0,40.0)),
+	]
+	assert [s['text'] for s in segments] == ['a','b','c']
+
+def test_to_absolute_with_tempo_only():
+	chunk = make_chunk('audio.pcm',SAMPLE_RATE * 100,np.zeros(SAMPLE_RATE * 10,dtype=np.int16),3,'flac',tempo=1.25)
+	assert (chunk['start'],chunk['end']) == pytest.approx((125.0,137.5))
+	segments = to_absolute([{'start': 2.0,'end': 4.0,'text': 'x'}],chunk)
+	assert (segments[0]['start'],segments[0]['end']) == pytest.approx((127.5,130.0))
+
+def test_make_chunk_composes_trimmer_and_tempo():
+	trimmer,kept = trim(ORIGINAL,4096)
+	chunk = make_chunk('audio.pcm',0,kept,0,'flac',trimmer,tempo=1.5)
+	assert chunk['time_map'][1] == pytest.approx([trimmer.pieces[1][0] / SAMPLE_RATE,trimmer.pieces[1][1] / SAMPLE_RATE * 1.5])
+	t = (trimmer.pieces[1][0] + SAMPLE_RATE) / SAMPLE_RATE
+	expected = (trimmer.pieces[1][1] / SAMPLE_RATE + 1.0) * 1.5
+	assert to_absolute([{'start': t,'end': t,'text': ''}],chunk)[0]['start'] == pytest.approx(expected)
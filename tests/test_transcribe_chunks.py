@@ -0,0 +1,46 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+import groq_whisper
+from groq_whisper import iter_transcribed_chunks
+from rate_limiter import ApiKeysUnauthorizedError
+from scheduler import FairScheduler, get_loop
+
+
+def test_early_exit_stops_feeding_and_closes_chunks(monkeypatch):
+	produced = []
+	sent = []
+	closed = threading.Event()
+
+	def chunks():
+		# 模拟边解码边产生分片的 iter_chunks
+		try:
+			for index in range(10):
+				time.sleep(0.05)
+				produced.append(index)
+				yield {'index': index,'codec': 'flac','start': float(index),'end': index + 1.0}
+		finally:
+			closed.set()
+
+	async def transcribe(chunk,options):
+		sent.append(chunk['index'])
+		if chunk['index'] == 0:
+			raise ApiKeysUnauthorizedError("bad key")
+		await asyncio.sleep(30)
+		return []
+
+	monkeypatch.setattr(groq_whisper,'transcript_with_retry',transcribe)
+	monkeypatch.setattr(groq_whisper,'get_scheduler',lambda: FairScheduler(get_loop(),{'transcribe': 4}))
+
+	with pytest.raises(ApiKeysUnauthorizedError):
+		for _ in iter_transcribed_chunks(chunks()):
+			pass
+
+	assert closed.wait(2)
+	time.sleep(0.3)
+	assert len(produced) < 10
+	assert len(sent) < 10
+	assert len(sent) <= len(produced)
@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 本地缓存目录及其大小上限，超过上限时按最近最少使用淘汰
+TRANSCRIPT_CACHE_DIR = 'transcript_cache'
+TRANSCRIPT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 目录大小在进程内按写入量累计，超过上限时才扫描目录淘汰；其他进程也会写入同一目录，
+# 因此每写入 TRANSCRIPT_CACHE_RESCAN_PUTS 次也重新扫描一次校正
+TRANSCRIPT_CACHE_RESCAN_PUTS = 100
+# 淘汰到上限的这一比例以下，留出余量，避免缓存满后每次写入都扫描目录
+TRANSCRIPT_CACHE_EVICT_TO = 0.9
+
+
+def youtube_video_id(url):
+	# 支持 watch?v=、youtu.be/、shorts/、embed/、live/ 等常见链接形式
+	match = re.search(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})',url or '')
+	return match.group(1) if match else None
+
+def file_fingerprint(path,block_size=1024*1024):
+	# 上传文件原始字节的哈希，计算时无需解码
+	digest = hashlib.sha256()
+	with open(path,'rb') as f:
+		for block in iter(lambda: f.read(block_size),b''):
+			digest.update(block)
+	return f'file:{digest.hexdigest()}'
+
+def transcript_cache_key(source_id,options):
+	# source_id 为音频指纹或 youtube:<video id>，options 为模型及转录参数
+	payload = json.dumps({'source': source_id, 'options': options},sort_keys=True)
+	return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+class SupabaseCacheTier:
+	"""Optional shared tier backed by a Supabase table with `key` (text, primary key) and `segments` (jsonb) columns."""
+
+	def __init__(self,client_factory,table):
+		self.client_factory = client_factory
+		self.table = table
+
+	def get(self,key):
+		response = self.client_factory().table(self.table).select('segments').eq('key',key).execute()
+		return response.data[0]['segments'] if response.data else None
+
+	def put(self,key,segments):
+		self.client_factory().table(self.table).upsert({'key': key, 'segments': segments}).execute()
+
+
+class TranscriptCache:
+	"""Content-addressed store of merged transcript segments.
+
+	Entries are JSON files on local disk, evicted least-recently-used once the
+	directory exceeds `max_bytes`. The directory size is tracked as entries are
+	written, so a put only scans the directory when it goes over the cap. An
+	optional remote tier is consulted on a local miss and written through on
+	every put; its errors are logged and otherwise ignored so the cache can
+	never fail a job.
+	"""
+
+	def __init__(self,root=TRANSCRIPT_CACHE_DIR,max_bytes=TRANSCRIPT_CACHE_MAX_BYTES,remote=None):
+		self.root = root
+		self.max_bytes = max_bytes
+		self.remote = remote
+		self.lock = threading.Lock()
+		os.makedirs(root,exist_ok=True)
+		# 目录的估计大小，None 表示尚未扫描
+		self.size = None
+		self.puts_since_scan = 0
+
+	def _path(self,key):
+		return os.path.join(self.root,f'{key}.json')
+
+	def get(self,key):
+		path = self._path(key)
+		try:
+			with open(path,encoding='utf8') as f:
+				segments = json.load(f)
+			# 命中时更新修改时间，作为 LRU 的依据
+			os.utime(path)
+			logger.info(f"transcript cache hit: {key}")
+			return segments
+		except (OSError,ValueError):
+			pass
+
+		if self.remote is None:
+			return None
+		try:
+			segments = self.remote.get(key)
+		except Exception as e:
+			logger.warning(f"remote transcript cache lookup failed: {e}")
+			return None
+		if segments is not None:
+			logger.info(f"remote transcript cache hit: {key}")
+			self._write_local(key,segments)
+		return segments
+
+	def put(self,key,segments):
+		self._write_local(key,segments)
+		if self.remote is not None:
+			try:
+				self.remote.put(key,segments)
+			except Exception as e:
+				logger.warning(f"remote transcript cache write failed: {e}")
+
+	def _write_local(self,key,segments):
+		path = self._path(key)
+		tmp_path = f'{path}.{threading.get_ident()}.tmp'
+		with open(tmp_path,'w',encoding='utf8') as f:
+			json.dump(segments,f,ensure_ascii=False)
+		size = os.path.getsize(tmp_path)
+		try:
+			size -= os.path.getsize(path)
+		except OSError:
+			pass
+		os.replace(tmp_path,path)
+		with self.lock:
+			self.puts_since_scan += 1
+			if self.size is not None:
+				self.size += size
+			scan = self.size is None or self.size > self.max_bytes or self.puts_since_scan >= TRANSCRIPT_CACHE_RESCAN_PUTS
+		if scan:
+			self.evict()
+
+	def evict(self):
+		with self.lock:
+			entries = []
+			for name in os.listdir(self.root):
+				if not name.endswith('.json'):
+					continue
+				try:
+					stat = os.stat(os.path.join(self.root,name))
+				except OSError:
+					continue
+				entries.append((stat.st_mtime,stat.st_size,name))
+			total = sum(size for _,size,_ in entries)
+			limit = self.max_bytes if total <= self.max_bytes else self.max_bytes * TRANSCRIPT_CACHE_EVICT_TO
+			for _,size,name in sorted(entries):
+				if total <= limit:
+					break
+				try:
+					os.remove(os.path.join(self.root,name))
+					total -= size
+				except OSError:
+					pass
+			self.size = total
+			self.puts_since_scan = 0
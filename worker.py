@@ -0,0 +1,97 @@
+import os
+import sys
+import socket
+import argparse
+import threading
+import subprocess
+import streamlit as st
+import logging
+from job_queue import get_job_queue
+from pipeline import run_job, save_kg_json
+
+
+logger = logging.getLogger(__name__)
+
+# 队列为空时的轮询间隔，以及运行中任务的心跳间隔（秒）
+WORKER_POLL_SECONDS = 1
+WORKER_HEARTBEAT_SECONDS = 10
+# 每个 worker 进程同时运行的任务数；各任务的分片共享进程内的全局调度器
+WORKER_THREADS = 4
+
+
+def send_heartbeats(queue,job_id,done):
+	while not done.wait(WORKER_HEARTBEAT_SECONDS):
+		try:
+			queue.heartbeat(job_id)
+		except Exception as e:
+			logger.warning(f"heartbeat for job {job_id} failed: {e}")
+
+def work(queue,worker_id,stop):
+	# 不断领取并运行任务，直到 stop 被设置
+	while not stop.is_set():
+		job = queue.claim(worker_id)
+		if job is None:
+			stop.wait(WORKER_POLL_SECONDS)
+			continue
+		logger.info(f"{worker_id} running job {job['id']} ({job['kind']})")
+		done = threading.Event()
+		threading.Thread(target=send_heartbeats,args=(queue,job['id'],done),daemon=True).start()
+		try:
+			result = run_job(job,queue)
+		except Exception as e:
+			logger.exception(f"job {job['id']} failed")
+			queue.fail(job['id'],e)
+		else:
+			queue.finish(job['id'],result)
+		finally:
+			done.set()
+
+def watch_parent(parent_pid,stop):
+	# 由网页进程启动时，网页进程退出后 worker 随之退出
+	while not stop.wait(WORKER_POLL_SECONDS):
+		if os.getppid() != parent_pid:
+			logger.info("parent process exited, stopping worker")
+			stop.set()
+
+
+def spawn_workers(processes):
+	"""Start `processes` worker processes next to the web app and return their Popen handles."""
+	script = os.path.abspath(__file__)
+	# 继承网页进程的工作目录：任务数据库、上传文件、会话目录和缓存都是相对路径
+	return [
+		subprocess.Popen([sys.executable,script,'--parent',str(os.getpid())])
+		for _ in range(processes)
+	]
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Run WhisperFlow transcription jobs from the job queue.")
+	parser.add_argument('--threads',type=int,default=None,help="jobs to run at the same time in this process")
+	parser.add_argument('--parent',type=int,default=None,help="exit when this process is no longer the parent")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	threads = args.threads or int(st.secrets.get('job_worker_threads',WORKER_THREADS))
+	save_kg_json()
+
+	queue = get_job_queue()
+	stop = threading.Event()
+	if args.parent:
+		threading.Thread(target=watch_parent,args=(args.parent,stop),daemon=True).start()
+	worker_prefix = f'{socket.gethostname()}:{os.getpid()}'
+	workers = [
+		threading.Thread(target=work,args=(queue,f'{worker_prefix}:{i}',stop),name=f'job-worker-{i}')
+		for i in range(threads)
+	]
+	logger.info(f"worker {worker_prefix} started with {threads} thread(s)")
+	for thread in workers:
+		thread.start()
+	try:
+		for thread in workers:
+			thread.join()
+	except KeyboardInterrupt:
+		stop.set()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,118 @@
+import os
+import time
+import shutil
+import tempfile
+import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 所有任务工作目录的根目录，以及单个任务工作目录的大小上限
+WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(),'whisperflow_jobs')
+WORKSPACE_MAX_BYTES = 2 * 1024**3
+
+
+class WorkspaceFullError(Exception):
+	pass
+
+
+def tree_usage(path):
+	# 返回 (总字节数, 最近修改时间)，path 可以是文件或目录
+	stat = os.stat(path)
+	total,newest = stat.st_size if not os.path.isdir(path) else 0,stat.st_mtime
+	for root,_,files in os.walk(path):
+		for f in files:
+			try:
+				stat = os.stat(os.path.join(root,f))
+			except OSError:
+				continue
+			total += stat.st_size
+			newest = max(newest,stat.st_mtime)
+	return total,newest
+
+def prune_lru(root,max_bytes,min_age_seconds=0):
+	"""Remove the least recently modified entries directly under root until it holds at most max_bytes.
+
+	Entries modified within the last `min_age_seconds` are kept even if root
+	stays over the limit, so files a queued or running job still needs are
+	not removed from under it.
+	"""
+	if not os.path.isdir(root):
+		return
+	entries = []
+	for name in os.listdir(root):
+		path = os.path.join(root,name)
+		try:
+			size,mtime = tree_usage(path)
+		except OSError:
+			continue
+		entries.append((mtime,size,path))
+	total = sum(size for _,size,_ in entries)
+	now = time.time()
+	for mtime,size,path in sorted(entries):
+		if total <= max_bytes or now - mtime < min_age_seconds:
+			break
+		try:
+			if os.path.isdir(path):
+				shutil.rmtree(path)
+			else:
+				os.remove(path)
+		except OSError as e:
+			logger.warning(f"could not remove {path}: {e}")
+			continue
+		total -= size
+		logger.info(f"removed {path} ({size} bytes) to keep {root} under {max_bytes} bytes")
+
+
+class JobWorkspace:
+	"""Private scratch directory for one transcription job.
+
+	Intermediate audio and chunk files live here instead of the process CWD,
+	so concurrent sessions never overwrite each other. The directory is removed
+	when the job finishes and refuses to grow past `max_bytes`. A persistent
+	workspace is named after the job id, so a job picked up again after a
+	crash finds the files it had already written.
+	"""
+
+	def __init__(self,job_id=None,root=WORKSPACE_ROOT,max_bytes=WORKSPACE_MAX_BYTES,persistent=False):
+		self.job_id = job_id or uuid.uuid4().hex
+		self.max_bytes = max_bytes
+		os.makedirs(root,exist_ok=True)
+		if persistent:
+			self.dir = os.path.join(root,self.job_id)
+			os.makedirs(self.dir,exist_ok=True)
+		else:
+			self.dir = tempfile.mkdtemp(prefix=f'{self.job_id}_',dir=root)
+		logger.info(f"job workspace ready: {self.dir}")
+
+	def path(self,*parts):
+		# 返回工作目录下的路径，并确保父目录存在
+		path = os.path.join(self.dir,*parts)
+		os.makedirs(os.path.dirname(path),exist_ok=True)
+		return path
+
+	def size(self):
+		total = 0
+		for root,_,files in os.walk(self.dir):
+			for f in files:
+				try:
+					total += os.path.getsize(os.path.join(root,f))
+				except OSError:
+					pass
+		return total
+
+	def ensure_capacity(self,n_bytes=0):
+		used = self.size()
+		if used + n_bytes > self.max_bytes:
+			raise WorkspaceFullError(f"workspace {self.dir} would grow to {used + n_bytes} bytes, limit is {self.max_bytes}")
+
+	def cleanup(self):
+		shutil.rmtree(self.dir,ignore_errors=True)
+		logger.info(f"job workspace removed: {self.dir}")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,exc_type,exc,tb):
+		self.cleanup()
@@ -0,0 +1,103 @@
+import os
+import itertools
+import collections
+import concurrent.futures
+import requests
+import logging
+from pytube import YouTube
+
+
+logger = logging.getLogger(__name__)
+
+# 转录只需要 16kHz 单声道，选择码率不低于该值的最小音频流即可
+YOUTUBE_MIN_AUDIO_KBPS = 48
+# 分段并发下载：每段的字节数和同时下载的段数
+RANGE_PART_BYTES = 8 * 1024 * 1024
+RANGE_WORKERS = 8
+# 音频流容器格式对应的扩展名
+AUDIO_EXTENSIONS = {'mp4': 'm4a', 'webm': 'weba'}
+
+
+def stream_kbps(stream):
+	# pytube 的 abr 形如 "128kbps"
+	try:
+		return int(stream.abr.rstrip('kbps'))
+	except (AttributeError,ValueError):
+		return 0
+
+def select_audio_stream(streams,min_kbps=YOUTUBE_MIN_AUDIO_KBPS):
+	# 满足最低码率的流中选最小的；都不满足时选码率最高的
+	audio = sorted(streams.filter(only_audio=True),key=lambda stream: (stream_kbps(stream),stream.filesize))
+	if not audio:
+		raise ValueError("no audio-only stream available")
+	adequate = [stream for stream in audio if stream_kbps(stream) >= min_kbps]
+	return adequate[0] if adequate else audio[-1]
+
+
+def fetch_range(url,start,end):
+	response = requests.get(url,headers={'Range': f'bytes={start}-{end}'},timeout=60)
+	response.raise_for_status()
+	if len(response.content) != end - start + 1:
+		raise IOError(f"range {start}-{end} returned {len(response.content)} bytes")
+	return response.content
+
+def iter_ranges(url,size,part_bytes=RANGE_PART_BYTES,workers=RANGE_WORKERS):
+	"""Yield the `size` bytes at url in order, keeping `workers` range requests in flight ahead of the reader."""
+	starts = iter(range(0,size,part_bytes))
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+		def submit(start):
+			return pool.submit(fetch_range,url,start,min(start + part_bytes,size) - 1)
+		pending = collections.deque(submit(start) for start in itertools.islice(starts,workers))
+		while pending:
+			data = pending.popleft().result()
+			for start in itertools.islice(starts,1):
+				pending.append(submit(start))
+			yield data
+
+def download_ranges(url,path,size,part_bytes=RANGE_PART_BYTES,workers=RANGE_WORKERS):
+	"""Download `size` bytes from url into path with parallel HTTP range requests."""
+	with open(path,'wb') as f:
+		for data in iter_ranges(url,size,part_bytes,workers):
+			f.write(data)
+	return path
+
+
+class YouTubeAudioStream:
+	"""Audio-only download of one YouTube video that can be decoded while it arrives.
+
+	The smallest audio-only stream of at least `min_kbps` is chosen, typically
+	a few percent of the size of the highest-resolution video. Resolving the
+	stream and fetching the first range happen in the constructor, so a
+	blocked or unavailable video fails before anything is decoded. Iterating
+	yields the file's bytes in order, fetched with parallel range requests,
+	and saves them to `audio_file`, which is complete once iteration ends.
+	"""
+
+	def __init__(self,youtube_url,output_dir,min_kbps=YOUTUBE_MIN_AUDIO_KBPS):
+		self.yt = YouTube(youtube_url)
+		self.output_dir = output_dir
+		self.source_id = f'youtube:{self.yt.video_id}'
+		# 时长来自视频元数据，无需等下载完成再探测
+		self.duration = self.yt.length
+		self.stream = select_audio_stream(self.yt.streams,min_kbps)
+		self.audio_file = os.path.join(output_dir,f"{self.yt.video_id}_audio.{AUDIO_EXTENSIONS.get(self.stream.subtype,self.stream.subtype)}")
+		logger.info(f"streaming {self.stream.abr} {self.stream.mime_type} audio ({self.stream.filesize / 1e6:.1f} MB) of {youtube_url}")
+		self.ranges = iter_ranges(self.stream.url,self.stream.filesize)
+		self.first = next(self.ranges,b'')
+
+	def __iter__(self):
+		part_file = f'{self.audio_file}.part'
+		with open(part_file,'wb') as f:
+			for data in itertools.chain([self.first],self.ranges):
+				f.write(data)
+				yield data
+		os.replace(part_file,self.audio_file)
+
+	def download_preview(self):
+		# 页面需要显示视频时，另外下载最低分辨率的音视频合一流
+		stream = self.yt.streams.filter(progressive=True,file_extension='mp4').get_lowest_resolution()
+		if stream is None:
+			return None
+		preview_file = os.path.join(self.output_dir,f"{self.yt.video_id}_preview.mp4")
+		logger.info(f"downloading {stream.resolution} preview ({stream.filesize / 1e6:.1f} MB) of {self.yt.watch_url}")
+		return download_ranges(stream.url,preview_file,stream.filesize)